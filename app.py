@@ -5,15 +5,52 @@ TaskFlow - Sistema de gestión de tareas con interfaz unificada
 import json
 import os
 import sys
+import time
+import queue
+import sqlite3
+import hashlib
+import tempfile
+import threading
 import requests
+from contextlib import contextmanager
 from datetime import datetime
 from flask import Flask, jsonify, request, render_template_string, redirect, url_for
 
+try:
+    import fcntl
+except ImportError:  # Windows: se usa msvcrt
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
 # Definimos la ruta del archivo 'tasks.json' dentro de la carpeta del proyecto
 TASKS_FILE = os.path.join(os.path.dirname(__file__), 'tasks.json')
+# Diario de cambios desde la última instantánea (tasks.json) y cuándo compactarlo
+TASKS_JOURNAL_FILE = os.path.join(os.path.dirname(__file__), 'tasks.journal')
+JOURNAL_FSYNC = True
+COMPACT_INTERVAL = 30
+COMPACT_MIN_ENTRIES = 100
+# Escrituras agrupadas: ventana de espera (segundos) y tamaño máximo de cada lote
+GROUP_COMMIT_WINDOW = 0.002
+GROUP_COMMIT_MAX_BATCH = 64
+GROUP_COMMIT_BATCH_BUCKETS = ((1, '1'), (4, '2-4'), (16, '5-16'), (64, '17-64'), (float('inf'), '65+'))
+# Almacén de tareas: "journal" (tasks.json + diario) o "sqlite" (base compartida por todas las instancias)
+TASKS_BACKEND = "journal"
+TASKS_DB_FILE = os.path.join(os.path.dirname(__file__), 'tasks.db')
+SQLITE_POOL_SIZE = 4
+SQLITE_BUSY_TIMEOUT = 5.0
+SQLITE_SYNCHRONOUS = "FULL"
+# Reintentos de una escritura cuando otra instancia cambió las tareas entre la lectura y el guardado
+WRITE_RETRIES = 5
 
 app = Flask(__name__)
 start_time = datetime.now()
+local_file_lock = threading.Lock()
+# Permisos de los archivos nuevos: os.umask solo se puede leer cambiándolo, así que se hace una vez al cargar
+_umask = os.umask(0)
+os.umask(_umask)
 
 # Función para registrar eventos en el servicio de logs
 def log_event(message):
@@ -22,34 +59,724 @@ def log_event(message):
     except:
         pass
 
+class TasksFileError(Exception):
+    """'tasks.json' existe pero no contiene una lista de tareas válida."""
+
+
+class TasksVersionConflict(Exception):
+    """Otra instancia siguió modificando las tareas durante todos los reintentos de una escritura."""
+
+
+def parse_tasks(data, strict=False):
+    """
+    Interpreta el contenido de 'tasks.json'. Si tiene un formato incorrecto, retorna una lista vacía
+    (o lanza TasksFileError con strict=True).
+    Filtra las tareas que no contienen el campo 'title' y asegura que todas tengan 'completed'.
+    """
+    try:
+        tasks = json.loads(data)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        if strict:
+            raise TasksFileError(str(e)) from e
+        return []
+    if not isinstance(tasks, list):
+        if strict:
+            raise TasksFileError("se esperaba una lista de tareas")
+        return []
+    valid_tasks = []
+    for task in tasks:
+        if isinstance(task, dict) and 'title' in task:
+            if 'completed' not in task:
+                task['completed'] = False
+            valid_tasks.append(task)
+    return valid_tasks
+
+
 def load_tasks():
     """
     Carga las tareas desde el archivo JSON. Si el archivo no existe o tiene un formato incorrecto, retorna una lista vacía.
-    Filtra las tareas que no contienen el campo 'title' y asegura que todas tengan 'completed'.
     """
     if not os.path.exists(TASKS_FILE):
         return []
 
-    with open(TASKS_FILE, "r") as file:
+    with open(TASKS_FILE, "rb") as file:
+        return parse_tasks(file.read())
+
+
+def fsync_directory(path):
+    """
+    Sincroniza el directorio para que el rename sobreviva a un corte de luz (no disponible en Windows).
+    """
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_file_atomic(path, data):
+    """
+    Escribe el archivo completo en uno temporal y lo sustituye de golpe: nunca queda a medio escribir.
+    El temporal tiene nombre único para que dos procesos no se pisen, y los permisos del archivo que
+    sustituye (mkstemp lo crea con 0600).
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o666 & ~_umask
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    try:
+        if hasattr(os, 'fchmod'):
+            os.fchmod(fd, mode)
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    fsync_directory(path)
+
+
+@contextmanager
+def tasks_file_lock(exclusive=True):
+    """
+    Bloqueo consultivo entre procesos sobre '<TASKS_FILE>.lock': fcntl.flock, o msvcrt.locking en Windows
+    (solo exclusivo). Si no hay ninguno de los dos solo se serializan los hilos del proceso: las escrituras
+    dependen de la comprobación de versión y dos instancias escribiendo a la vez pueden perder cambios.
+    """
+    if fcntl is None and msvcrt is not None:
+        with open(f"{TASKS_FILE}.lock", "a+b") as lock_file:
+            # msvcrt bloquea rangos de bytes: el primero, aunque el archivo esté vacío
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK se rinde tras 10 intentos de un segundo
+                    continue
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        return
+    if fcntl is None:
+        with local_file_lock:
+            yield
+        return
+    with open(f"{TASKS_FILE}.lock", "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
         try:
-            tasks = json.load(file)
-            valid_tasks = []
-            for task in tasks:
-                if isinstance(task, dict) and 'title' in task:
-                    if 'completed' not in task:
-                        task['completed'] = False
-                    valid_tasks.append(task)
-            return valid_tasks
-        except json.JSONDecodeError:
-            return []
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def export_tasks(tasks, path=None):
+    """
+    Guarda las tareas con el formato de 'tasks.json' (por defecto en el propio TASKS_FILE).
+    Retorna los bytes escritos.
+    """
+    data = json.dumps(tasks, indent=4).encode('utf-8')
+    write_file_atomic(path or TASKS_FILE, data)
+    return data
 
 
 def save_tasks(tasks):
     """
-    Guarda las tareas en el archivo JSON.
+    Guarda las tareas en el archivo JSON (reemplazo atómico con el bloqueo entre procesos tomado).
+    """
+    with tasks_file_lock():
+        export_tasks(tasks)
+
+
+def file_signature(path):
+    """
+    Identifica la versión de un archivo sin leerlo: (inodo, mtime en ns, tamaño), o None si no existe.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def snapshot_id(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def apply_operation(tasks, operation):
+    """
+    Aplica una operación del diario sobre una lista nueva y retorna (lista, tarea afectada o None).
+    """
+    op = operation.get('op')
+    if op == 'add':
+        task = {'title': operation['title'], 'completed': False}
+        return tasks + [task], task
+    index = operation.get('index')
+    if not isinstance(index, int) or not 0 <= index < len(tasks):
+        return tasks, None
+    tasks = list(tasks)
+    if op == 'complete':
+        tasks[index] = dict(tasks[index], completed=True)
+        return tasks, tasks[index]
+    if op == 'delete':
+        return tasks, tasks.pop(index)
+    return tasks, None
+
+
+class PendingWrite:
+    """
+    Operación esperando a que su lote se guarde.
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class GroupCommitter:
     """
-    with open(TASKS_FILE, "w") as file:
-        json.dump(tasks, file, indent=4)
+    Agrupa en un solo guardado las escrituras que llegan a la vez.
+
+    La primera escritura que encuentra libre el almacén hace de líder: espera hasta
+    GROUP_COMMIT_WINDOW a que se sumen más (o a juntar GROUP_COMMIT_MAX_BATCH), guarda el lote
+    entero con commit_batch y despierta al resto. Mientras un lote se guarda, las escrituras que
+    llegan forman el siguiente. Cada petición responde solo cuando su lote ya está en disco.
+    """
+
+    def __init__(self, commit_batch):
+        self.commit_batch = commit_batch
+        self.cond = threading.Condition()
+        self.pending = []
+        self.committing = False
+        self.commits = 0
+        self.operations = 0
+        self.max_batch = 0
+        self.batch_sizes = {label: 0 for _, label in GROUP_COMMIT_BATCH_BUCKETS}
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.last_latency = 0.0
+        self.last_batch = 0
+
+    def submit(self, operation):
+        """
+        Encola la operación y espera a que su lote se guarde; retorna su resultado.
+        """
+        write = PendingWrite(operation)
+        with self.cond:
+            self.pending.append(write)
+            self.cond.notify_all()
+            while not write.done:
+                if self.committing:
+                    self.cond.wait()
+                    continue
+                self.committing = True
+                batch = self._collect()
+                self.cond.release()
+                try:
+                    self._commit(batch)
+                finally:
+                    self.cond.acquire()
+                    self.committing = False
+                    self.cond.notify_all()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def _collect(self):
+        """
+        Espera a que se junte el lote (con el lock tomado) y lo saca de la cola.
+        Sin concurrencia (el lote anterior fue de una sola escritura y no hay más en cola) no se
+        espera: una escritura suelta no paga la ventana.
+        """
+        deadline = time.monotonic() + GROUP_COMMIT_WINDOW
+        if self.last_batch <= 1 and len(self.pending) <= 1:
+            deadline = 0
+        while len(self.pending) < GROUP_COMMIT_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.cond.wait(remaining)
+        batch = self.pending[:GROUP_COMMIT_MAX_BATCH]
+        del self.pending[:GROUP_COMMIT_MAX_BATCH]
+        return batch
+
+    def _commit(self, batch):
+        started = time.perf_counter()
+        try:
+            results = self.commit_batch([write.operation for write in batch])
+            error = None
+        except Exception as e:
+            results = [None] * len(batch)
+            error = e
+        elapsed = time.perf_counter() - started
+        with self.cond:
+            for write, result in zip(batch, results):
+                write.result = result
+                write.error = error
+                write.done = True
+            self.commits += 1
+            self.operations += len(batch)
+            self.max_batch = max(self.max_batch, len(batch))
+            self.last_batch = len(batch)
+            for limit, label in GROUP_COMMIT_BATCH_BUCKETS:
+                if len(batch) <= limit:
+                    self.batch_sizes[label] += 1
+                    break
+            self.latency_total += elapsed
+            self.latency_max = max(self.latency_max, elapsed)
+            self.last_latency = elapsed
+
+    def stats(self):
+        with self.cond:
+            return {
+                'commits': self.commits,
+                'operations': self.operations,
+                'pending': len(self.pending),
+                'avg_batch_size': round(self.operations / self.commits, 2) if self.commits else 0,
+                'max_batch_size': self.max_batch,
+                'batch_sizes': dict(self.batch_sizes),
+                'avg_commit_ms': round(self.latency_total / self.commits * 1000, 3) if self.commits else 0,
+                'max_commit_ms': round(self.latency_max * 1000, 3),
+                'last_commit_ms': round(self.last_latency * 1000, 3),
+                'window_ms': GROUP_COMMIT_WINDOW * 1000,
+                'max_batch': GROUP_COMMIT_MAX_BATCH,
+            }
+
+
+class TaskStore:
+    """
+    Tareas en memoria persistidas como un diario de operaciones.
+
+    'tasks.json' es la última instantánea y 'tasks.journal' guarda, una línea JSON por cambio,
+    lo ocurrido desde entonces; la primera línea del diario identifica la instantánea a la que se aplica.
+    Cada cambio solo añade una línea al diario, y un hilo en segundo plano compacta diario e
+    instantánea cada cierto tiempo. Al arrancar (o si otra instancia que comparte los archivos los
+    cambia) se lee la instantánea y se repiten las operaciones del diario; una última línea a medio
+    escribir por una caída se descarta.
+    Las lecturas devuelven una lista que no se modifica nunca: cada cambio crea una lista nueva.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tasks = []
+        self.snapshot_signature = False
+        self.journal_signature = False
+        self.snapshot_id = None
+        self.journal_offset = 0
+        self.journal_entries = 0
+        self.journal_valid = False
+        self.version = 0
+        self.compactions = 0
+        self.conflicts = 0
+        self.file_locked = False
+        self.committer = GroupCommitter(self.commit_batch)
+
+    def _changed(self):
+        return (file_signature(TASKS_FILE) != self.snapshot_signature
+                or file_signature(TASKS_JOURNAL_FILE) != self.journal_signature)
+
+    def _read_journal(self, offset):
+        """
+        Operaciones completas del diario a partir de `offset`; retorna (operaciones, nuevo offset).
+        """
+        try:
+            with open(TASKS_JOURNAL_FILE, "rb") as file:
+                file.seek(offset)
+                data = file.read()
+        except FileNotFoundError:
+            return [], 0
+        # Lo que haya tras el último salto de línea es una escritura interrumpida; el offset se queda
+        # al final de la última línea válida y _append descarta lo que venga detrás
+        complete = data[:data.rfind(b"\n") + 1]
+        operations = []
+        for line in complete.splitlines(keepends=True):
+            try:
+                operations.append(json.loads(line))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                break
+            offset += len(line)
+        return operations, offset
+
+    def _load(self):
+        """
+        Lectura completa: instantánea más las operaciones del diario que le corresponden.
+        Se hace con el bloqueo compartido para no mezclar la instantánea y el diario de una compactación
+        a medias. Una instantánea ilegible lanza TasksFileError y se conserva lo que había en memoria.
+        """
+        if self.file_locked:
+            self._load_files()
+            return
+        with tasks_file_lock(exclusive=False):
+            self._load_files()
+
+    def _load_files(self):
+        try:
+            with open(TASKS_FILE, "rb") as file:
+                data = file.read()
+                stat = os.fstat(file.fileno())
+                signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            data = b""
+            signature = None
+        tasks = parse_tasks(data, strict=True) if data else []
+        self.snapshot_signature = signature
+        self.snapshot_id = snapshot_id(data)
+
+        self.journal_signature = file_signature(TASKS_JOURNAL_FILE)
+        operations, self.journal_offset = self._read_journal(0)
+        header = operations[0] if operations else {}
+        # Un diario de otra instantánea (caída entre los dos pasos de una compactación) ya está incluido en ella
+        self.journal_valid = header.get('snapshot') == self.snapshot_id
+        self.journal_entries = 0
+        if self.journal_valid:
+            for operation in operations[1:]:
+                tasks, _ = apply_operation(tasks, operation)
+                self.journal_entries += 1
+        elif operations:
+            print(f"⚠️ {TASKS_JOURNAL_FILE} no corresponde a la instantánea actual: se ignora")
+        self.tasks = tasks
+        self.version += 1
+
+    def _refresh(self):
+        snapshot_signature = file_signature(TASKS_FILE)
+        journal_signature = file_signature(TASKS_JOURNAL_FILE)
+        if snapshot_signature != self.snapshot_signature:
+            self._load()
+        elif journal_signature != self.journal_signature:
+            same_file = (journal_signature is not None and self.journal_signature
+                         and journal_signature[0] == self.journal_signature[0]
+                         and journal_signature[2] >= self.journal_offset)
+            if not same_file or not self.journal_valid:
+                self._load()
+                return
+            # Otra instancia añadió operaciones: solo se lee lo nuevo
+            operations, self.journal_offset = self._read_journal(self.journal_offset)
+            tasks = self.tasks
+            for operation in operations:
+                tasks, _ = apply_operation(tasks, operation)
+            self.tasks = tasks
+            self.journal_entries += len(operations)
+            self.journal_signature = journal_signature
+            self.version += 1
+
+    def _start_journal(self):
+        header = json.dumps({'snapshot': self.snapshot_id}).encode('utf-8') + b"\n"
+        write_file_atomic(TASKS_JOURNAL_FILE, header)
+        self.journal_offset = len(header)
+        self.journal_entries = 0
+        self.journal_valid = True
+
+    def _append(self, operations):
+        if not self.journal_valid:
+            self._start_journal()
+        data = b"".join(json.dumps(operation).encode('utf-8') + b"\n" for operation in operations)
+        signature = file_signature(TASKS_JOURNAL_FILE)
+        if signature is not None and signature[2] > self.journal_offset:
+            # Restos de una escritura interrumpida (se llama con el bloqueo exclusivo tomado): si se
+            # añadiera detrás, la línea nueva quedaría pegada a ellos y ninguna réplica la leería
+            with open(TASKS_JOURNAL_FILE, "r+b") as file:
+                file.truncate(self.journal_offset)
+        with open(TASKS_JOURNAL_FILE, "ab") as file:
+            file.write(data)
+            file.flush()
+            if JOURNAL_FSYNC:
+                os.fsync(file.fileno())
+            end = file.tell()
+        if end - len(data) != self.journal_offset:
+            # Otra instancia añadió líneas justo antes que las nuestras (solo sin bloqueo): se relee todo
+            self.conflicts += 1
+            self.snapshot_signature = False
+        self.journal_offset += len(data)
+        self.journal_entries += len(operations)
+        self.journal_signature = file_signature(TASKS_JOURNAL_FILE)
+
+    def commit_batch(self, operations):
+        """
+        Aplica un lote de operaciones con una sola escritura (y un solo fsync) del diario.
+        Retorna, en orden, la tarea afectada por cada operación o None si no se aplicó.
+        """
+        with self.lock:
+            for _ in range(WRITE_RETRIES):
+                with self._file_lock():
+                    self._refresh()
+                    tasks = self.tasks
+                    results = []
+                    applied = []
+                    for operation in operations:
+                        tasks, task = apply_operation(tasks, operation)
+                        results.append(task)
+                        if task is not None:
+                            applied.append(operation)
+                    if not applied:
+                        return results
+                    # Comprobación de versión: sin bloqueo otra instancia pudo escribir desde la lectura
+                    if self._changed():
+                        self.conflicts += 1
+                        continue
+                    self._append(applied)
+                    self.tasks = tasks
+                    self.version += 1
+                    return results
+            raise TasksVersionConflict(f"{len(operations)} operaciones sin guardar tras {WRITE_RETRIES} intentos")
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        Bloqueo exclusivo entre procesos, tomado siempre con self.lock; mientras se tiene, _load no
+        pide el compartido.
+        """
+        with tasks_file_lock():
+            self.file_locked = True
+            try:
+                yield
+            finally:
+                self.file_locked = False
+
+    def all(self):
+        """
+        Lista actual de tareas (solo lectura).
+        """
+        if self._changed():
+            with self.lock:
+                try:
+                    self._refresh()
+                except TasksFileError as e:
+                    # Mejor servir la última lista buena que una vacía que luego se guardaría
+                    print(f"❌ {TASKS_FILE} ilegible, se mantienen las tareas en memoria: {e}")
+        return self.tasks
+
+    def add(self, title):
+        return self.committer.submit({'op': 'add', 'title': title})
+
+    def complete(self, task_id):
+        """
+        Marca la tarea como completada; retorna la tarea o None si el índice no existe.
+        """
+        return self.committer.submit({'op': 'complete', 'index': task_id})
+
+    def delete(self, task_id):
+        """
+        Elimina la tarea; retorna la tarea eliminada o None si el índice no existe.
+        """
+        return self.committer.submit({'op': 'delete', 'index': task_id})
+
+    def compact(self):
+        """
+        Escribe una instantánea nueva con todas las operaciones y empieza un diario vacío.
+        Primero se sustituye la instantánea y después el diario: si se cae entre medias, el diario
+        viejo ya no corresponde a la instantánea y se ignora, sin perder nada.
+        """
+        with self.lock, self._file_lock():
+            self._refresh()
+            if self.journal_entries < COMPACT_MIN_ENTRIES:
+                return False
+            data = export_tasks(self.tasks)
+            self.snapshot_signature = file_signature(TASKS_FILE)
+            self.snapshot_id = snapshot_id(data)
+            self._start_journal()
+            self.journal_signature = file_signature(TASKS_JOURNAL_FILE)
+            self.compactions += 1
+            return True
+
+    def compaction_loop(self):
+        while True:
+            time.sleep(COMPACT_INTERVAL)
+            try:
+                self.compact()
+            except (OSError, TasksFileError) as e:
+                print(f"❌ Error compactando el diario de tareas: {e}")
+
+
+def journal_tasks():
+    """
+    Tareas del almacén "journal" con el diario ya aplicado. Lanza TasksFileError si 'tasks.json' está
+    dañado, en vez de devolver una lista vacía.
+    """
+    journal_store = TaskStore()
+    with journal_store.lock:
+        journal_store._refresh()
+    return journal_store.tasks
+
+
+# Sentencias SQL fijas: sqlite3 las prepara una vez por conexión y las reutiliza
+SQL_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS tasks ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    " title TEXT NOT NULL,"
+    " completed INTEGER NOT NULL DEFAULT 0)",
+    "CREATE INDEX IF NOT EXISTS idx_tasks_completed ON tasks (completed)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)",
+)
+SQL_VERSION = "SELECT value FROM meta WHERE key = 'version'"
+SQL_BUMP_VERSION = "UPDATE meta SET value = value + 1 WHERE key = 'version'"
+SQL_SELECT_ALL = "SELECT title, completed FROM tasks ORDER BY id"
+SQL_SELECT_AT = "SELECT id, title, completed FROM tasks ORDER BY id LIMIT 1 OFFSET ?"
+SQL_COUNT = "SELECT COUNT(*) FROM tasks"
+SQL_INSERT = "INSERT INTO tasks (title, completed) VALUES (?, ?)"
+SQL_COMPLETE = "UPDATE tasks SET completed = 1 WHERE id = ?"
+SQL_DELETE = "DELETE FROM tasks WHERE id = ?"
+
+
+class SQLiteTaskStore:
+    """
+    Tareas en una base SQLite (modo WAL) compartida por todas las instancias.
+
+    Cada cambio es una transacción que además incrementa meta.version; las lecturas solo consultan
+    esa versión y sirven la lista en memoria mientras no cambie. El id de la API sigue siendo la
+    posición de la tarea en la lista, igual que con 'tasks.json'.
+    Las conexiones salen de un pool pequeño por proceso.
+    """
+
+    def __init__(self, path=None, pool_size=None):
+        self.path = path or TASKS_DB_FILE
+        self.lock = threading.Lock()
+        self.tasks = []
+        self.version = None
+        self.committer = GroupCommitter(self.commit_batch)
+        self.pool = queue.Queue()
+        for _ in range(pool_size or SQLITE_POOL_SIZE):
+            self.pool.put(self._connect())
+        with self._connection() as conn:
+            self._migrate(conn)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None,
+                               check_same_thread=False, cached_statements=len(SQL_SCHEMA) + 16)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        conn = self.pool.get()
+        try:
+            yield conn
+        finally:
+            self.pool.put(conn)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Transacción de escritura: BEGIN IMMEDIATE toma el bloqueo de escritura desde el principio,
+        así dos instancias no leen la misma posición para luego pisarse.
+        """
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute(SQL_BUMP_VERSION)
+            conn.execute("COMMIT")
+
+    def _migrate(self, conn):
+        """
+        Crea el esquema y, si la base está vacía, importa las tareas del almacén "journal"
+        (instantánea más diario, no solo 'tasks.json').
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in SQL_SCHEMA:
+                conn.execute(statement)
+            if conn.execute(SQL_COUNT).fetchone()[0] == 0 and conn.execute(SQL_VERSION).fetchone()[0] == 0:
+                tasks = journal_tasks()
+                conn.executemany(SQL_INSERT, [(task['title'], int(bool(task['completed']))) for task in tasks])
+                conn.execute(SQL_BUMP_VERSION)
+                if tasks:
+                    print(f"📦 {len(tasks)} tareas importadas de {TASKS_FILE} y {TASKS_JOURNAL_FILE} a {self.path}")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def all(self):
+        """
+        Lista actual de tareas (solo lectura).
+        """
+        with self._connection() as conn:
+            version = conn.execute(SQL_VERSION).fetchone()[0]
+            if version == self.version:
+                return self.tasks
+            # Versión y filas en la misma transacción de lectura para que cuadren
+            conn.execute("BEGIN")
+            try:
+                version = conn.execute(SQL_VERSION).fetchone()[0]
+                rows = conn.execute(SQL_SELECT_ALL).fetchall()
+            finally:
+                conn.execute("COMMIT")
+        tasks = [{'title': title, 'completed': bool(completed)} for title, completed in rows]
+        with self.lock:
+            if self.version is None or version > self.version:
+                self.tasks, self.version = tasks, version
+        return tasks
+
+    def add(self, title):
+        return self.committer.submit({'op': 'add', 'title': title})
+
+    def complete(self, task_id):
+        """
+        Marca la tarea como completada; retorna la tarea o None si el índice no existe.
+        """
+        return self.committer.submit({'op': 'complete', 'index': task_id})
+
+    def delete(self, task_id):
+        """
+        Elimina la tarea; retorna la tarea eliminada o None si el índice no existe.
+        """
+        return self.committer.submit({'op': 'delete', 'index': task_id})
+
+    def _execute(self, conn, operation):
+        if operation['op'] == 'add':
+            conn.execute(SQL_INSERT, (operation['title'], 0))
+            return {'title': operation['title'], 'completed': False}
+        index = operation['index']
+        row = conn.execute(SQL_SELECT_AT, (index,)).fetchone() if index >= 0 else None
+        if row is None:
+            return None
+        if operation['op'] == 'complete':
+            conn.execute(SQL_COMPLETE, (row[0],))
+            return {'title': row[1], 'completed': True}
+        conn.execute(SQL_DELETE, (row[0],))
+        return {'title': row[1], 'completed': bool(row[2])}
+
+    def commit_batch(self, operations):
+        """
+        Aplica un lote de operaciones en una sola transacción (un solo commit a disco).
+        Retorna, en orden, la tarea afectada por cada operación o None si no se aplicó.
+        """
+        with self._transaction() as conn:
+            return [self._execute(conn, operation) for operation in operations]
+
+
+def create_store():
+    """
+    Crea el almacén de tareas indicado en TASKS_BACKEND ("journal" o "sqlite").
+    """
+    if TASKS_BACKEND == "sqlite":
+        return SQLiteTaskStore()
+    if TASKS_BACKEND != "journal":
+        raise ValueError(f"TASKS_BACKEND desconocido: {TASKS_BACKEND}")
+    task_store = TaskStore()
+    threading.Thread(target=task_store.compaction_loop, daemon=True).start()
+    return task_store
+
+
+store = create_store()
 
 
 # Template HTML unificado
@@ -615,7 +1342,7 @@ def get_unified_template():
 # Ruta principal - Muestra la interfaz de usuario
 @app.route('/')
 def index():
-    tasks = load_tasks()
+    tasks = store.all()
     server_port = request.host.split(':')[1] if ':' in request.host else '5000'
     return render_template_string(get_unified_template(), tasks=tasks, server_port=server_port)
 
@@ -628,13 +1355,13 @@ def server_info():
         'server_port': request.host.split(':')[1] if ':' in request.host else '5000',
         'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         'uptime': str(datetime.now() - start_time),
-        'tasks_count': len(load_tasks())
+        'tasks_count': len(store.all())
     })
 
 # Información del sistema
 @app.route('/system-info')
 def system_info():
-    tasks = load_tasks()
+    tasks = store.all()
     completed_tasks = len([t for t in tasks if t.get('completed', False)])
     pending_tasks = len(tasks) - completed_tasks
     
@@ -838,25 +1565,33 @@ def health_check():
         "status": "ok",
         "version": "2.0.0",
         "timestamp": datetime.now().isoformat(),
-        "tasks_count": len(load_tasks())
+        "tasks_count": len(store.all())
+    }), 200
+
+# Endpoint con las métricas del almacén de tareas
+@app.route("/api/storage", methods=["GET"])
+def storage_stats():
+    """Métricas del almacén de tareas: tamaño de los lotes y latencia de cada guardado"""
+    return jsonify({
+        "backend": TASKS_BACKEND,
+        "version": store.version,
+        "write_conflicts": getattr(store, 'conflicts', 0),
+        "group_commit": store.committer.stats()
     }), 200
 
 # API - Obtener todas las tareas
 @app.route('/api/tasks', methods=['GET'])
 def get_tasks():
-    tasks = load_tasks()
+    tasks = store.all()
     return jsonify(tasks)
 
 # API - Agregar una nueva tarea
 @app.route('/api/tasks', methods=['POST'])
 def add_task():
-    tasks = load_tasks()
     data = request.json
 
     if 'title' in data:
-        new_task = {'title': data['title'], 'completed': False}
-        tasks.append(new_task)
-        save_tasks(tasks)
+        new_task = store.add(data['title'])
         log_event(f"API: Nueva tarea añadida: {data['title']}")
         return jsonify(new_task), 201
     return jsonify({"error": "El título de la tarea es requerido"}), 400
@@ -864,23 +1599,19 @@ def add_task():
 # API - Marcar una tarea como completada
 @app.route('/api/tasks/<int:task_id>/complete', methods=['PUT'])
 def complete_task(task_id):
-    tasks = load_tasks()
+    task = store.complete(task_id)
 
-    if 0 <= task_id < len(tasks):
-        tasks[task_id]['completed'] = True
-        save_tasks(tasks)
-        log_event(f"API: Tarea completada: {tasks[task_id]['title']}")
-        return jsonify(tasks[task_id])
+    if task is not None:
+        log_event(f"API: Tarea completada: {task['title']}")
+        return jsonify(task)
     return jsonify({"error": "Tarea no encontrada"}), 404
 
 # API - Eliminar una tarea
 @app.route('/api/tasks/<int:task_id>', methods=['DELETE'])
 def delete_task(task_id):
-    tasks = load_tasks()
+    deleted_task = store.delete(task_id)
 
-    if 0 <= task_id < len(tasks):
-        deleted_task = tasks.pop(task_id)
-        save_tasks(tasks)
+    if deleted_task is not None:
         log_event(f"API: Tarea eliminada: {deleted_task['title']}")
         return jsonify(deleted_task)
     return jsonify({"error": "Tarea no encontrada"}), 404
@@ -888,38 +1619,29 @@ def delete_task(task_id):
 # Rutas web para interacción desde el navegador
 @app.route('/tasks/add', methods=['POST'])
 def web_add_task():
-    tasks = load_tasks()
     title = request.form.get('title')
 
     if title:
-        new_task = {'title': title, 'completed': False}
-        tasks.append(new_task)
-        save_tasks(tasks)
+        store.add(title)
         log_event(f"WEB: Nueva tarea añadida: {title} (servidor {request.host})")
 
     return redirect(url_for('index'))
 
 @app.route('/tasks/<int:task_id>/complete', methods=['POST'])
 def web_complete_task(task_id):
-    tasks = load_tasks()
+    task = store.complete(task_id)
 
-    if 0 <= task_id < len(tasks):
-        task_title = tasks[task_id]['title']
-        tasks[task_id]['completed'] = True
-        save_tasks(tasks)
-        log_event(f"WEB: Tarea completada: {task_title} (servidor {request.host})")
+    if task is not None:
+        log_event(f"WEB: Tarea completada: {task['title']} (servidor {request.host})")
 
     return redirect(url_for('index'))
 
 @app.route('/tasks/<int:task_id>/delete', methods=['POST'])
 def web_delete_task(task_id):
-    tasks = load_tasks()
+    deleted_task = store.delete(task_id)
 
-    if 0 <= task_id < len(tasks):
-        task_title = tasks[task_id]['title']
-        tasks.pop(task_id)
-        save_tasks(tasks)
-        log_event(f"WEB: Tarea eliminada: {task_title} (servidor {request.host})")
+    if deleted_task is not None:
+        log_event(f"WEB: Tarea eliminada: {deleted_task['title']} (servidor {request.host})")
 
     return redirect(url_for('index'))
 
@@ -0,0 +1,45 @@
+'''
+Microbenchmark: leer las tareas del almacén en memoria (TaskStore) frente a leer tasks.json
+del disco en cada petición (load_tasks, como hacían las rutas antes).
+
+Uso: python benchmarks/bench_task_store.py
+'''
+
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+SIZES = (10, 1000, 10000)
+
+
+def per_call_us(func, repeat=5):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number * 1e6
+
+
+def main():
+    print(f"{'tareas':>8} {'load_tasks()':>14} {'store.all()':>13} {'mejora':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        app.TASKS_FILE = os.path.join(directory, 'tasks.json')
+        app.TASKS_JOURNAL_FILE = os.path.join(directory, 'tasks.journal')
+        for size in SIZES:
+            tasks = [{'title': f"tarea {i}", 'completed': i % 3 == 0} for i in range(size)]
+            with open(app.TASKS_FILE, 'w') as file:
+                json.dump(tasks, file, indent=4)
+            store = app.TaskStore()
+            assert store.all() == app.load_tasks()
+
+            disk = per_call_us(app.load_tasks)
+            memory = per_call_us(store.all)
+            print(f"{size:>8} {disk:>12.1f}µs {memory:>11.2f}µs {disk / memory:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,127 +1,2544 @@
 from flask import Flask, request, Response, render_template_string
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from http import cookiejar
+import os
+import hmac
 import random
+import math
+import itertools
+import hashlib
+import bisect
+import heapq
+import socket
 import time
+from array import array
 import threading
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import atexit
 import json
+import queue
+import gzip
+import zlib
 from datetime import datetime, timedelta
-from collections import defaultdict, deque
-
-# Configuración del logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("balancer.log"),
-        logging.StreamHandler()
-    ]
-)
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Configuración del logging: los hilos de las peticiones solo encolan; un hilo aparte
+# escribe JSON de una línea en el fichero (con rotación) y en la consola
+LOG_FILE = "balancer.log"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_QUEUE_SIZE = 10000
+# Fracción de las peticiones exitosas (< 400) que se escriben; los errores se escriben siempre
+LOG_SUCCESS_SAMPLE_RATE = 0.1
+
+log_stats = {"dropped": 0, "sampled_out": 0}
+log_stats_lock = threading.Lock()
+
+class JSONFormatter(logging.Formatter):
+    """Una línea JSON por evento; los campos de los logs de acceso van como claves propias"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        return json.dumps(entry, ensure_ascii=False)
+
+class DroppingQueueHandler(QueueHandler):
+    """Encola sin bloquear: si la cola está llena el evento se descarta y se cuenta"""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with log_stats_lock:
+                log_stats["dropped"] += 1
+
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+log_handler = DroppingQueueHandler(log_queue)
+log_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[log_handler])
+
+_log_file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+_log_console_handler = logging.StreamHandler()
+for _handler in (_log_file_handler, _log_console_handler):
+    _handler.setFormatter(JSONFormatter())
+log_listener = QueueListener(log_queue, _log_file_handler, _log_console_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
 logger = logging.getLogger("balanceador")
+# Las peticiones ya quedan en el log de acceso muestreado (access_log); el log de Werkzeug
+# escribiría todas otra vez, sin muestrear. Sus avisos y errores sí se mantienen
+logging.getLogger("werkzeug").setLevel(logging.WARNING)
 
 app = Flask(__name__)
 
-# Lista de servidores backend
+# Lista de servidores backend (valores iniciales; en marcha se cambian con /lb-admin/backends
+# o editando BACKENDS_FILE)
 SERVERS = [
     "http://localhost:5001",
     "http://localhost:5002"
 ]
 
+# Fichero opcional con los backends, releído al cambiar:
+# {"servers": [{"url": "http://localhost:5001", "weight": 1, "draining": false}, ...]}
+BACKENDS_FILE = "backends.json"
+BACKENDS_WATCH_INTERVAL = 2
+# Si se define, la API /lb-admin exige la cabecera X-Admin-Token; si no, solo acepta localhost
+ADMIN_TOKEN = None
+
 # Configuración
-RETRY_INTERVAL = 30
 HEALTH_CHECK_INTERVAL = 5
-MAX_REQUEST_HISTORY = 1000
+UPSTREAM_TIMEOUT = 5
+
+# Health checks concurrentes: intervalo adaptativo por backend con jitter
+HEALTH_CHECK_TIMEOUT = 3
+HEALTH_CHECK_WORKERS = 4
+HEALTH_CHECK_MIN_INTERVAL = 1
+HEALTH_CHECK_MAX_INTERVAL = 20
+HEALTH_CHECK_JITTER = 0.2
+HEALTH_FLAP_WINDOW = 6
+MAX_REQUEST_HISTORY = 50
+
+# Estrategia de reparto: least_outstanding, p2c_ewma, weighted_round_robin, random o consistent_hash
+BALANCING_STRATEGY = "least_outstanding"
+SERVER_WEIGHTS = {}
+EWMA_DECAY = 10.0
+
+# consistent_hash: clave de afinidad ("ip", "cookie:<nombre>", "header:<nombre>" o "path:<segmentos>")
+HASH_KEY = "ip"
+VIRTUAL_NODES = 100
+
+# Circuit breaker por backend: se abre por fallos consecutivos o por tasa de error,
+# y tras un backoff exponencial deja pasar unas pocas peticiones de prueba
+BREAKER_CONSECUTIVE_FAILURES = 5
+BREAKER_ERROR_RATE = 0.5
+BREAKER_WINDOW = 20
+BREAKER_MIN_REQUESTS = 10
+BREAKER_BASE_BACKOFF = 2
+BREAKER_MAX_BACKOFF = 60
+BREAKER_HALF_OPEN_TRIALS = 3
+BREAKER_HALF_OPEN_SUCCESSES = 3
+
+# Hedging de GET/HEAD: si no hay respuesta en el percentil HEDGE_PERCENTILE de la ruta,
+# se lanza una segunda petición a otro backend y gana la primera que responda
+HEDGE_ENABLED = True
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_DELAY = 0.02
+HEDGE_DEFAULT_DELAY = 0.5
+HEDGE_WORKERS = 64
+
+# Presupuesto de reintentos: hedges y failovers no pueden pasar de esta fracción del tráfico
+RETRY_BUDGET_RATIO = 0.1
+RETRY_BUDGET_MIN_PER_SECOND = 1
+RETRY_BUDGET_MAX_TOKENS = 50
+
+# Caché de respuestas GET: ruta -> grupo de invalidación, y prefijos de escritura que
+# invalidan cada grupo. Sin Cache-Control del backend se usa CACHE_DEFAULT_TTL
+CACHE_ENABLED = True
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+CACHE_MAX_ENTRY_BYTES = 1024 * 1024
+CACHE_DEFAULT_TTL = 2
+CACHE_ROUTES = {'/': 'tasks', '/info': 'tasks', '/api/tasks': 'tasks'}
+CACHE_INVALIDATIONS = {'/api/tasks': 'tasks', '/tasks/': 'tasks'}
+# Cabeceras con credenciales: forman parte de la clave y sus respuestas solo se guardan si son "public"
+CACHE_KEY_HEADERS = ('Authorization', 'Cookie')
+
+# Agrupación de GET idénticos en curso: cabeceras que forman parte de la clave, espera
+# máxima de los que se suman y tamaño máximo de la respuesta que se comparte
+COALESCE_ENABLED = True
+COALESCE_KEY_HEADERS = ('Accept', 'Accept-Encoding', 'Accept-Language', 'Authorization', 'Cookie')
+COALESCE_MAX_WAIT = 3
+COALESCE_MAX_BODY_BYTES = 1024 * 1024
+
+# Control de admisión: peticiones en curso como máximo en total y por backend. Con el
+# límite adaptativo, el de cada backend baja cuando su latencia sube respecto a la mínima
+# observada. Las que no caben esperan en una cola acotada hasta ADMISSION_QUEUE_TIMEOUT
+# segundos; si no, 503 con Retry-After
+ADMISSION_MAX_IN_FLIGHT = 200
+BACKEND_MAX_IN_FLIGHT = 50
+ADAPTIVE_LIMIT_ENABLED = True
+ADAPTIVE_MIN_LIMIT = 4
+ADAPTIVE_MIN_LATENCY_WINDOW = 30
+# Latencia hasta TOLERANCE veces la mínima se considera normal; por debajo del suelo todo es ruido
+ADAPTIVE_TOLERANCE = 2.0
+ADAPTIVE_LATENCY_FLOOR = 0.005
+ADMISSION_QUEUE_SIZE = 100
+ADMISSION_QUEUE_TIMEOUT = 1.0
+ADMISSION_RETRY_AFTER = 1
+
+# Compresión de respuestas en el balanceador (gzip, o Brotli si está instalado el paquete)
+COMPRESSION_ENABLED = True
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_LEVEL = 6
+BROTLI_QUALITY = 4
+# Solo se comprimen estos tipos; imágenes, vídeo o zip ya vienen comprimidos
+COMPRESSIBLE_TYPES = ('text/html', 'text/plain', 'text/css', 'text/csv', 'application/json',
+                      'application/javascript', 'text/javascript', 'application/xml', 'image/svg+xml')
+
+# Pool de conexiones keep-alive hacia los backends
+POOL_MAXSIZE = 20
+POOL_IDLE_TIMEOUT = 60
+POOL_EVICT_INTERVAL = 15
+
+# Reenvío de respuestas por bloques
+STREAM_CHUNK_SIZE = 16 * 1024
+HOP_BY_HOP_HEADERS = ('connection', 'keep-alive', 'transfer-encoding')
+
+# Cuerpo de la petición: bytes que se guardan para poder reintentar en otro backend
+REPLAY_BUFFER_SIZE = 1024 * 1024
+
+# Métricas: número de shards entre los que se reparten los hilos
+METRICS_SHARDS = 16
+
+# Histogramas de latencia: cubetas logarítmicas (8 por potencia de 2, hasta 2**28 µs)
+# agrupadas en ranuras de 10s para las ventanas deslizantes
+HISTOGRAM_SUB_BUCKETS = 8
+HISTOGRAM_MAX_EXPONENT = 28
+HISTOGRAM_SLOT_SECONDS = 10
+HISTOGRAM_WINDOWS = {'1m': 60, '5m': 300, '15m': 900}
+HISTOGRAM_PERCENTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p999', 0.999))
+# Copias de cada histograma entre las que se reparten los hilos (cada una ocupa ~85 KB)
+HISTOGRAM_SHARDS = 4
+# Límites (en segundos) de las cubetas acumuladas que se exportan en /lb-metrics
+PROMETHEUS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATUS_CLASSES = ('error', '1xx', '2xx', '3xx', '4xx', '5xx')
+MAX_TRACKED_ROUTES = 50
+# Dashboard en vivo (SSE): cada cuánto se calculan los cambios, cada cuánto se manda un
+# ping si no hay nada nuevo y cuántos mensajes puede acumular un cliente lento
+SSE_INTERVAL = 1
+SSE_HEARTBEAT = 15
+SSE_QUEUE_SIZE = 30
+# Series de tráfico por backend: (nombre, segundos por punto, puntos guardados)
+SERIES_TIERS = (('second', 1, 300), ('minute', 60, 120), ('hour', 3600, 48))
+
+class LatencyHistogram:
+    """Histograma logarítmico de latencias de memoria fija con ventanas de 1m/5m/15m"""
+
+    BUCKETS = HISTOGRAM_MAX_EXPONENT * HISTOGRAM_SUB_BUCKETS + 1
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slot_count = max(HISTOGRAM_WINDOWS.values()) // HISTOGRAM_SLOT_SECONDS
+        self.slots = [array('I', [0]) * self.BUCKETS for _ in range(self.slot_count)]
+        self.slot_max = array('d', [0.0]) * self.slot_count
+        # Suma de las ranuras de cada ventana, mantenida al rotar para que leer no recorra las ranuras
+        self.windows = [
+            (name, seconds // HISTOGRAM_SLOT_SECONDS, array('Q', [0]) * self.BUCKETS)
+            for name, seconds in HISTOGRAM_WINDOWS.items()
+        ]
+        self.current = int(time.monotonic() // HISTOGRAM_SLOT_SECONDS)
+        # Totales desde el arranque para /lb-metrics: la última cubeta es +Inf
+        self.cumulative = array('Q', [0]) * (len(PROMETHEUS_BUCKETS) + 1)
+        self.sum = 0.0
+
+    @classmethod
+    def bucket_index(cls, seconds):
+        micros = seconds * 1e6
+        if micros < 1:
+            return 0
+        mantissa, exponent = math.frexp(micros)
+        index = (exponent - 1) * HISTOGRAM_SUB_BUCKETS + int((mantissa * 2 - 1) * HISTOGRAM_SUB_BUCKETS) + 1
+        return min(index, cls.BUCKETS - 1)
+
+    @staticmethod
+    def bucket_value(index):
+        """Valor representativo (punto medio) de la cubeta, en segundos"""
+        if index == 0:
+            return 0.0
+        exponent, sub = divmod(index - 1, HISTOGRAM_SUB_BUCKETS)
+        return (2 ** exponent) * (1 + (sub + 0.5) / HISTOGRAM_SUB_BUCKETS) / 1e6
+
+    def _advance(self, slot):
+        """Rota las ranuras hasta `slot` descontando de cada ventana las que salen (con el lock tomado)"""
+        if slot - self.current >= self.slot_count:
+            for counts in self.slots:
+                counts[:] = array('I', [0]) * self.BUCKETS
+            for _, _, counts in self.windows:
+                counts[:] = array('Q', [0]) * self.BUCKETS
+            self.slot_max[:] = array('d', [0.0]) * self.slot_count
+            self.current = slot
+            return
+        while self.current < slot:
+            self.current += 1
+            for _, span, counts in self.windows:
+                expired = self.slots[(self.current - span) % self.slot_count]
+                for i, count in enumerate(expired):
+                    if count:
+                        counts[i] -= count
+            position = self.current % self.slot_count
+            self.slots[position][:] = array('I', [0]) * self.BUCKETS
+            self.slot_max[position] = 0.0
+
+    def record(self, seconds):
+        index = self.bucket_index(seconds)
+        slot = int(time.monotonic() // HISTOGRAM_SLOT_SECONDS)
+        with self.lock:
+            if slot != self.current:
+                self._advance(slot)
+            position = slot % self.slot_count
+            self.slots[position][index] += 1
+            for _, _, counts in self.windows:
+                counts[index] += 1
+            if seconds > self.slot_max[position]:
+                self.slot_max[position] = seconds
+            self.cumulative[bisect.bisect_left(PROMETHEUS_BUCKETS, seconds)] += 1
+            self.sum += seconds
+
+    def totals(self):
+        """Cubetas acumuladas (le) y suma de todas las muestras desde el arranque"""
+        with self.lock:
+            counts = list(itertools.accumulate(self.cumulative))
+            return counts, self.sum
+
+    def snapshot(self, window=None):
+        """Cubetas y máximo de cada ventana (o solo de `window`) en el instante actual: [(nombre, cubetas, máximo)]"""
+        with self.lock:
+            self._advance(int(time.monotonic() // HISTOGRAM_SLOT_SECONDS))
+            return [
+                (name, counts.tolist(), max(self.slot_max[(self.current - k) % self.slot_count] for k in range(span)))
+                for name, span, counts in self.windows if window in (None, name)
+            ]
+
+    def quantile(self, q, window='1m'):
+        """Latencia en segundos del cuantil q en la ventana indicada (None si no hay muestras)"""
+        return window_quantile(self.snapshot(window), q, window)
+
+    def summary(self):
+        """Percentiles y máximo de cada ventana, en milisegundos"""
+        return window_summary(self.snapshot())
+
+def window_quantile(snapshot, q, window):
+    """Cuantil q de una ventana de snapshot() (None si no hay muestras)"""
+    for name, counts, _ in snapshot:
+        if name == window:
+            break
+    else:
+        raise KeyError(window)
+    total = sum(counts)
+    if not total:
+        return None
+    rank = max(1, math.ceil(q * total))
+    seen = 0
+    for index, count in enumerate(counts):
+        seen += count
+        if seen >= rank:
+            return LatencyHistogram.bucket_value(index)
+
+def window_summary(snapshot):
+    """Percentiles y máximo (en milisegundos) de cada ventana de snapshot()"""
+    result = {}
+    for name, counts, window_max in snapshot:
+        total = sum(counts)
+        entry = {"count": total}
+        targets = iter(HISTOGRAM_PERCENTILES)
+        label, q = next(targets)
+        seen = 0
+        for index, count in enumerate(counts):
+            if not count:
+                continue
+            seen += count
+            while label and seen >= max(1, math.ceil(q * total)):
+                entry[label] = round(min(LatencyHistogram.bucket_value(index), window_max) * 1000, 2)
+                label, q = next(targets, (None, None))
+        for label, _ in HISTOGRAM_PERCENTILES:
+            entry.setdefault(label, 0)
+        entry["max"] = round(window_max * 1000, 2)
+        result[name] = entry
+    return result
+
+class ShardedHistogram:
+    """LatencyHistogram repartido por hilos como MetricsShard: cada hilo escribe siempre en la misma
+    copia (su lock casi nunca tiene competencia) y las lecturas suman todas. Las copias se crean
+    cuando un hilo de ese shard escribe por primera vez"""
+
+    _local = threading.local()
+    _next_shard = itertools.count()
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.shards = [None] * HISTOGRAM_SHARDS
+
+    def record(self, seconds):
+        index = getattr(self._local, 'index', None)
+        if index is None:
+            index = self._local.index = next(self._next_shard) % HISTOGRAM_SHARDS
+        histogram = self.shards[index]
+        if histogram is None:
+            with self.lock:
+                histogram = self.shards[index]
+                if histogram is None:
+                    histogram = self.shards[index] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def _active(self):
+        return [histogram for histogram in self.shards if histogram is not None]
+
+    def totals(self):
+        """Cubetas acumuladas (le) y suma de todas las muestras desde el arranque"""
+        counts = [0] * (len(PROMETHEUS_BUCKETS) + 1)
+        total = 0.0
+        for histogram in self._active():
+            shard_counts, shard_sum = histogram.totals()
+            counts = [a + b for a, b in zip(counts, shard_counts)]
+            total += shard_sum
+        return counts, total
+
+    def snapshot(self, window=None):
+        merged = None
+        for histogram in self._active():
+            windows = histogram.snapshot(window)
+            if merged is None:
+                merged = windows
+                continue
+            merged = [
+                (name, [a + b for a, b in zip(counts, shard_counts)], max(window_max, shard_max))
+                for (name, counts, window_max), (_, shard_counts, shard_max) in zip(merged, windows)
+            ]
+        if merged is None:
+            merged = [(name, [0] * LatencyHistogram.BUCKETS, 0.0) for name in HISTOGRAM_WINDOWS
+                      if window in (None, name)]
+        return merged
+
+    def quantile(self, q, window='1m'):
+        """Latencia en segundos del cuantil q en la ventana indicada (None si no hay muestras)"""
+        return window_quantile(self.snapshot(window), q, window)
+
+    def summary(self):
+        """Percentiles y máximo de cada ventana, en milisegundos"""
+        return window_summary(self.snapshot())
+
+class SeriesTier:
+    """Anillo de memoria fija con peticiones, errores y suma de latencias por intervalo"""
+
+    __slots__ = ('step', 'size', 'stamps', 'requests', 'errors', 'latency_sum')
+
+    def __init__(self, step, size):
+        self.step = step
+        self.size = size
+        # Número de intervalo que ocupa cada posición; si no coincide, la posición está vieja
+        self.stamps = array('q', [-1]) * size
+        self.requests = array('I', [0]) * size
+        self.errors = array('I', [0]) * size
+        self.latency_sum = array('d', [0.0]) * size
+
+    def add(self, now, success, response_time):
+        interval = int(now // self.step)
+        position = interval % self.size
+        if self.stamps[position] != interval:
+            self.stamps[position] = interval
+            self.requests[position] = 0
+            self.errors[position] = 0
+            self.latency_sum[position] = 0.0
+        self.requests[position] += 1
+        if not success:
+            self.errors[position] += 1
+        self.latency_sum[position] += response_time
+
+    def read(self, now, points):
+        """Los últimos `points` intervalos (el más antiguo primero), con ceros donde no hubo tráfico"""
+        last = int(now // self.step)
+        requests, errors, latency = [], [], []
+        for interval in range(last - points + 1, last + 1):
+            position = interval % self.size
+            if self.stamps[position] == interval:
+                requests.append(self.requests[position])
+                errors.append(self.errors[position])
+                latency.append(self.latency_sum[position])
+            else:
+                requests.append(0)
+                errors.append(0)
+                latency.append(0.0)
+        return requests, errors, latency
+
+class ThroughputSeries:
+    """Series de tráfico por backend a resolución de segundo, minuto y hora.
+
+    Cada petición se suma directamente en los tres niveles, así los niveles gruesos
+    son agregados exactos del fino sin un hilo que los consolide. Igual que los contadores,
+    cada hilo escribe en su shard (MetricsShard) y las consultas suman todos.
+    """
+
+    def __init__(self):
+        self._shards = [MetricsShard() for _ in range(METRICS_SHARDS)]
+        self._next_shard = itertools.count()
+        self._local = threading.local()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = self._shards[next(self._next_shard) % METRICS_SHARDS]
+        return shard
+
+    def record(self, server, success, response_time, now=None):
+        now = time.time() if now is None else now
+        shard = self._shard()
+        with shard.lock:
+            tiers = shard.servers.get(server)
+            if tiers is None:
+                tiers = shard.servers[server] = {name: SeriesTier(step, size) for name, step, size in SERIES_TIERS}
+            for tier in tiers.values():
+                tier.add(now, success, response_time)
+
+    def query(self, tier_name, points=None, now=None):
+        """Serie de cada backend y el total para /lb-api/series"""
+        step, size = next((step, size) for name, step, size in SERIES_TIERS if name == tier_name)
+        points = size if points is None else max(1, min(points, size))
+        now = time.time() if now is None else now
+        first = (int(now // step) - points + 1) * step
+        result = {
+            "tier": tier_name,
+            "step": step,
+            "timestamps": [first + i * step for i in range(points)],
+            "servers": {}
+        }
+        merged = {}
+        for shard in self._shards:
+            with shard.lock:
+                reads = [(server, tiers[tier_name].read(now, points)) for server, tiers in shard.servers.items()]
+            for server, (requests, errors, latency) in reads:
+                totals = merged.get(server)
+                if totals is None:
+                    merged[server] = (requests, errors, latency)
+                    continue
+                for i in range(points):
+                    totals[0][i] += requests[i]
+                    totals[1][i] += errors[i]
+                    totals[2][i] += latency[i]
+        total_requests = [0] * points
+        total_errors = [0] * points
+        total_latency = [0.0] * points
+        for server, (requests, errors, latency) in merged.items():
+            result["servers"][server] = self._format(requests, errors, latency, step)
+            for i in range(points):
+                total_requests[i] += requests[i]
+                total_errors[i] += errors[i]
+                total_latency[i] += latency[i]
+        result["total"] = self._format(total_requests, total_errors, total_latency, step)
+        return result
+
+    @staticmethod
+    def _format(requests, errors, latency, step):
+        return {
+            "requests": requests,
+            "errors": errors,
+            "rps": [round(count / step, 3) for count in requests],
+            "error_rate": [round(e / r * 100, 1) if r else 0.0 for e, r in zip(errors, requests)],
+            "avg_ms": [round(total / r * 1000, 2) if r else 0.0 for total, r in zip(latency, requests)]
+        }
+
+def route_label(path):
+    """Agrupa las rutas con identificadores numéricos: /api/tasks/3 -> /api/tasks/:id"""
+    return '/'.join(':id' if segment.isdigit() else segment for segment in path.split('/'))
+
+class ServerCounters:
+    """Contadores de un backend dentro de un shard"""
+
+    __slots__ = ('total_requests', 'successful_requests', 'failed_requests',
+                 'response_time_sum', 'last_response_time', 'last_seen', 'status_classes')
+
+    def __init__(self):
+        self.total_requests = 0
+        self.successful_requests = 0
+        self.failed_requests = 0
+        self.response_time_sum = 0.0
+        self.last_response_time = 0.0
+        self.last_seen = 0.0
+        # Respuestas por clase de estado; la posición 0 son los fallos sin respuesta
+        self.status_classes = array('Q', [0]) * len(STATUS_CLASSES)
+
+class MetricsShard:
+    """Contadores de un grupo de hilos; su lock casi nunca tiene competencia"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total_requests = 0
+        self.servers = {}
 
 class LoadBalancerState:
     def __init__(self):
         self.failed_servers = {}
-        self.server_stats = defaultdict(lambda: {
-            'total_requests': 0,
-            'successful_requests': 0,
-            'failed_requests': 0,
-            'avg_response_time': 0,
-            'last_response_time': 0,
-            'uptime_start': datetime.now()
-        })
+        self.uptime_start = defaultdict(datetime.now)
+        # Solo para la lista de "requests recientes"; el histórico agregado está en series
         self.request_history = deque(maxlen=MAX_REQUEST_HISTORY)
-        self.total_requests = 0
+        self._request_seq = itertools.count(1)
+        self.series = ThroughputSeries()
         self.start_time = datetime.now()
-        
-    def add_request(self, server, success, response_time, path):
-        self.total_requests += 1
-        self.server_stats[server]['total_requests'] += 1
-        self.server_stats[server]['last_response_time'] = response_time
-        
-        if success:
-            self.server_stats[server]['successful_requests'] += 1
-        else:
-            self.server_stats[server]['failed_requests'] += 1
-            
-        stats = self.server_stats[server]
-        total = stats['successful_requests']
-        if total > 0:
-            current_avg = stats['avg_response_time']
-            stats['avg_response_time'] = ((current_avg * (total - 1)) + response_time) / total
-            
-        self.request_history.append({
-            'timestamp': datetime.now(),
-            'server': server,
-            'success': success,
-            'response_time': response_time,
-            'path': path
-        })
+        # Cada hilo escribe siempre en el mismo shard; las lecturas suman todos
+        self._shards = [MetricsShard() for _ in range(METRICS_SHARDS)]
+        self._next_shard = itertools.count()
+        self._local = threading.local()
+        self.server_latency = {}
+        self.route_latency = {}
+        self.probe_latency = {}
+        self._histograms_lock = threading.Lock()
+        self.probe_stats = defaultdict(lambda: {'probes': 0, 'failures': 0, 'last_probe_time': 0.0})
+        self._probe_lock = threading.Lock()
+
+    def _histogram(self, histograms, key, limit=None):
+        histogram = histograms.get(key)
+        if histogram is None:
+            with self._histograms_lock:
+                histogram = histograms.get(key)
+                if histogram is None:
+                    if limit is not None and len(histograms) >= limit:
+                        key = 'other'
+                        histogram = histograms.get(key)
+                    if histogram is None:
+                        histogram = histograms[key] = ShardedHistogram()
+        return histogram
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = self._shards[next(self._next_shard) % METRICS_SHARDS]
+        return shard
+
+    def add_request(self, server, success, response_time, path, status=None):
+        shard = self._shard()
+        with shard.lock:
+            shard.total_requests += 1
+            counters = shard.servers.get(server)
+            if counters is None:
+                counters = shard.servers[server] = ServerCounters()
+            counters.total_requests += 1
+            counters.last_response_time = response_time
+            counters.last_seen = time.monotonic()
+            if success:
+                counters.successful_requests += 1
+                counters.response_time_sum += response_time
+            else:
+                counters.failed_requests += 1
+            counters.status_classes[min(status // 100, 5) if status else 0] += 1
+
+        self._histogram(self.server_latency, server).record(response_time)
+        self._histogram(self.route_latency, route_label(path), MAX_TRACKED_ROUTES).record(response_time)
+
+        now = time.time()
+        self.series.record(server, success, response_time, now)
+        self.request_history.append((next(self._request_seq), now, server, success, response_time, path))
+
+    def recent_requests(self, limit, after=0):
+        """Últimas peticiones (las posteriores a la secuencia `after`) sin copiar todo el historial"""
+        recent = []
+        for offset in range(1, limit + 1):
+            try:
+                entry = self.request_history[-offset]
+            except IndexError:
+                break
+            if entry[0] <= after:
+                break
+            recent.append(entry)
+        recent.reverse()
+        return recent
+
+    def record_probe(self, server, healthy, response_time):
+        """Registra un health check aparte del tráfico de clientes"""
+        with self._probe_lock:
+            stats = self.probe_stats[server]
+            stats['probes'] += 1
+            if not healthy:
+                stats['failures'] += 1
+            stats['last_probe_time'] = response_time
+        self._histogram(self.probe_latency, server).record(response_time)
+
+    @property
+    def total_requests(self):
+        total = 0
+        for shard in self._shards:
+            with shard.lock:
+                total += shard.total_requests
+        return total
+
+    def server_stats(self):
+        """Suma los shards y devuelve los contadores de cada backend"""
+        merged = {}
+        for shard in self._shards:
+            with shard.lock:
+                for server, counters in shard.servers.items():
+                    stats = merged.get(server)
+                    if stats is None:
+                        stats = merged[server] = {
+                            'total_requests': 0,
+                            'successful_requests': 0,
+                            'failed_requests': 0,
+                            'response_time_sum': 0.0,
+                            'last_response_time': 0.0,
+                            'last_seen': 0.0,
+                            'status_classes': [0] * len(STATUS_CLASSES)
+                        }
+                    stats['total_requests'] += counters.total_requests
+                    stats['successful_requests'] += counters.successful_requests
+                    stats['failed_requests'] += counters.failed_requests
+                    stats['response_time_sum'] += counters.response_time_sum
+                    for index, count in enumerate(counters.status_classes):
+                        stats['status_classes'][index] += count
+                    if counters.last_seen > stats['last_seen']:
+                        stats['last_seen'] = counters.last_seen
+                        stats['last_response_time'] = counters.last_response_time
+        for stats in merged.values():
+            stats['avg_response_time'] = stats['response_time_sum'] / max(stats['successful_requests'], 1)
+        return merged
 
 state = LoadBalancerState()
 
+# Intento en curso del hilo (UpstreamAttempt): el pool le entrega la conexión que usa
+current_attempt = threading.local()
+
+class _TrackedPoolMixin:
+    """Lleva la cuenta de las conexiones que se piden y devuelven a un pool de urllib3"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lb_lock = threading.Lock()
+        self.checked_out = 0
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        with self.lb_lock:
+            self.checked_out += 1
+            if conn.sock is not None:
+                self.reused += 1
+            else:
+                self.created += 1
+        attempt = getattr(current_attempt, 'attempt', None)
+        if attempt is not None:
+            attempt.connected(conn)
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.lb_idle_since = time.monotonic()
+        with self.lb_lock:
+            self.checked_out -= 1
+        super()._put_conn(conn)
+
+    def idle_count(self):
+        queue = self.pool
+        if queue is None:
+            return 0
+        with queue.mutex:
+            return sum(1 for conn in queue.queue if conn is not None and conn.sock is not None)
+
+    def evict_idle(self, max_idle):
+        """Cierra las conexiones que llevan más de max_idle segundos sin usarse"""
+        queue = self.pool
+        if queue is None:
+            return 0
+        now = time.monotonic()
+        evicted = 0
+        with queue.mutex:
+            for i, conn in enumerate(queue.queue):
+                if conn is None or conn.sock is None:
+                    continue
+                if now - getattr(conn, 'lb_idle_since', now) > max_idle:
+                    conn.close()
+                    queue.queue[i] = None
+                    evicted += 1
+        if evicted:
+            with self.lb_lock:
+                self.evicted += evicted
+        return evicted
+
+class TrackedHTTPConnectionPool(_TrackedPoolMixin, HTTPConnectionPool):
+    pass
+
+class TrackedHTTPSConnectionPool(_TrackedPoolMixin, HTTPSConnectionPool):
+    pass
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """Adaptador de requests que usa los pools instrumentados"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TrackedHTTPConnectionPool,
+            'https': TrackedHTTPSConnectionPool
+        }
+
+class BackendPool:
+    """Sesión HTTP con conexiones keep-alive dedicada a un único backend"""
+
+    def __init__(self, server):
+        self.server = server
+        self.adapter = PooledHTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+        self.session = requests.Session()
+        # La sesión se comparte entre clientes: nunca debe guardar sus cookies
+        self.session.cookies.set_policy(cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    def _url_pools(self):
+        pools = self.adapter.poolmanager.pools
+        return [pool for pool in (pools.get(key) for key in pools.keys()) if pool is not None]
+
+    def evict_idle(self, max_idle):
+        return sum(pool.evict_idle(max_idle) for pool in self._url_pools())
+
+    def stats(self):
+        stats = {'checked_out': 0, 'idle': 0, 'created': 0, 'reused': 0, 'evicted': 0, 'max_size': POOL_MAXSIZE}
+        for pool in self._url_pools():
+            with pool.lb_lock:
+                stats['checked_out'] += pool.checked_out
+                stats['created'] += pool.created
+                stats['reused'] += pool.reused
+                stats['evicted'] += pool.evicted
+            stats['idle'] += pool.idle_count()
+        return stats
+
+class ConnectionPools:
+    """Registro de pools de conexiones, uno por backend"""
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get(self, server):
+        pool = self._pools.get(server)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(server)
+                if pool is None:
+                    pool = self._pools[server] = BackendPool(server)
+        return pool
+
+    def evict_idle(self):
+        return sum(pool.evict_idle(POOL_IDLE_TIMEOUT) for pool in list(self._pools.values()))
+
+    def remove(self, server):
+        # Las conexiones en uso se cierran al devolverse a un pool ya cerrado
+        with self._lock:
+            pool = self._pools.pop(server, None)
+        if pool is not None:
+            pool.session.close()
+
+    def stats(self):
+        per_server = {server: pool.stats() for server, pool in list(self._pools.items())}
+        totals = {key: sum(s[key] for s in per_server.values())
+                  for key in ('checked_out', 'idle', 'created', 'reused', 'evicted')}
+        return totals, per_server
+
+pools = ConnectionPools()
+
 def check_server_health(server):
     """Verificar si un servidor está activo"""
+    start_time = time.time()
     try:
-        start_time = time.time()
-        response = requests.get(f"{server}/health", timeout=3)
+        response = pools.get(server).session.get(f"{server}/health", timeout=HEALTH_CHECK_TIMEOUT)
         response_time = time.time() - start_time
         
         if response.status_code == 200:
-            state.add_request(server, True, response_time, '/health')
+            state.record_probe(server, True, response_time)
             return True
         else:
-            state.add_request(server, False, response_time, '/health')
+            state.record_probe(server, False, response_time)
             return False
     except Exception as e:
         logger.warning(f"Error en health check para {server}: {str(e)}")
-        state.add_request(server, False, 0, '/health')
+        state.record_probe(server, False, time.time() - start_time)
         return False
 
-def get_active_servers():
-    """Retorna lista de servidores activos basado en el estado actual"""
-    current_time = time.time()
-    active_servers = []
+class Backend:
+    """Entrada del registro de backends (inmutable: un cambio crea una entrada nueva)"""
+
+    __slots__ = ('url', 'weight', 'draining')
+
+    def __init__(self, url, weight=1, draining=False):
+        self.url = url
+        self.weight = weight
+        self.draining = draining
+
+    def to_dict(self):
+        return {"url": self.url, "weight": self.weight, "draining": self.draining}
+
+class RegistrySnapshot:
+    """Vista inmutable del registro que leen los hilos de las peticiones sin tomar locks"""
+
+    __slots__ = ('version', 'backends', 'servers', 'routable', 'weights')
+
+    def __init__(self, version, backends):
+        self.version = version
+        self.backends = backends
+        self.servers = tuple(backends)
+        # Los backends en drenaje terminan lo que tienen en curso pero no reciben peticiones nuevas
+        self.routable = tuple(url for url, backend in backends.items() if not backend.draining)
+        self.weights = {url: backend.weight for url, backend in backends.items()}
+
+class BackendRegistry:
+    """Backends modificables en caliente con copy-on-write: cada cambio publica una instantánea nueva"""
+
+    def __init__(self, servers, weights):
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.snapshot = RegistrySnapshot(1, {
+            url: Backend(url, max(1, int(weights.get(url, 1)))) for url in servers
+        })
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def _publish(self, backends):
+        """Reemplaza la instantánea y avisa a los suscriptores (con el lock tomado)"""
+        previous = self.snapshot
+        self.snapshot = RegistrySnapshot(previous.version + 1, backends)
+        removed = [url for url in previous.servers if url not in backends]
+        for listener in self.listeners:
+            listener(self.snapshot, removed)
+
+    def add(self, backend):
+        with self.lock:
+            if backend.url in self.snapshot.backends:
+                raise KeyError(backend.url)
+            backends = dict(self.snapshot.backends)
+            backends[backend.url] = backend
+            self._publish(backends)
+
+    def update(self, url, weight=None, draining=None):
+        with self.lock:
+            current = self.snapshot.backends[url]
+            backends = dict(self.snapshot.backends)
+            backends[url] = Backend(
+                url,
+                current.weight if weight is None else weight,
+                current.draining if draining is None else draining
+            )
+            self._publish(backends)
+
+    def remove(self, url):
+        with self.lock:
+            if url not in self.snapshot.backends:
+                raise KeyError(url)
+            backends = dict(self.snapshot.backends)
+            del backends[url]
+            self._publish(backends)
+
+    def replace(self, entries):
+        """Sustituye todo el registro (recarga de BACKENDS_FILE); devuelve si hubo cambios"""
+        with self.lock:
+            backends = {entry.url: entry for entry in entries}
+            current = {url: backend.to_dict() for url, backend in self.snapshot.backends.items()}
+            if current == {url: backend.to_dict() for url, backend in backends.items()}:
+                return False
+            self._publish(backends)
+            return True
+
+registry = BackendRegistry(SERVERS, SERVER_WEIGHTS)
+
+def parse_backend(data):
+    """Valida una entrada de backend de la API o del fichero; lanza ValueError si no es válida"""
+    if not isinstance(data, dict):
+        raise ValueError("cada backend debe ser un objeto")
+    url = str(data.get('url', '')).rstrip('/')
+    if not url.startswith(('http://', 'https://')) or len(url.split('//', 1)[1]) == 0:
+        raise ValueError(f"URL de backend no válida: {url!r}")
+    weight = data.get('weight', 1)
+    if not isinstance(weight, int) or isinstance(weight, bool) or weight < 1:
+        raise ValueError(f"peso no válido para {url}: {weight!r}")
+    return Backend(url, weight, bool(data.get('draining', False)))
+
+class BalancingStrategy:
+    """Base de las estrategias de reparto: lleva las peticiones en curso y la latencia EWMA de cada backend"""
+
+    name = None
+    uses_key = False
+
+    def __init__(self, servers, weights=None):
+        self.lock = threading.Lock()
+        self.outstanding = {}
+        self.ewma = {}
+        self.set_servers(servers, weights)
+
+    def set_servers(self, servers, weights=None):
+        with self.lock:
+            self.servers = list(servers)
+            self.weights = dict(weights or {})
+            for server in self.servers:
+                self.outstanding.setdefault(server, 0)
+                self.ewma.setdefault(server, (0.0, time.monotonic()))
+            self._rebuild()
+
+    def _rebuild(self):
+        """Recalcula las estructuras propias de la estrategia (se llama con el lock tomado)"""
+
+    def select(self, is_available, tried, key=None):
+        """Devuelve un backend disponible que no se haya probado aún, o None"""
+        raise NotImplementedError
+
+    def server_state_changed(self, server, available):
+        """Aviso de que un backend se marcó como caído o recuperado"""
+
+    def details(self):
+        """Información propia de la estrategia para /lb-api/stats"""
+        return {}
+
+    def _fallback(self, is_available, tried):
+        candidates = [s for s in self.servers if s not in tried and is_available(s)]
+        return random.choice(candidates) if candidates else None
+
+    def acquire(self, server):
+        with self.lock:
+            self.outstanding[server] = self.outstanding.get(server, 0) + 1
+
+    def release(self, server):
+        with self.lock:
+            self.outstanding[server] = max(0, self.outstanding.get(server, 0) - 1)
+
+    def observe(self, server, response_time):
+        """Actualiza la EWMA de latencia con decaimiento según el tiempo transcurrido"""
+        now = time.monotonic()
+        with self.lock:
+            value, last = self.ewma.get(server, (response_time, now))
+            weight = math.exp(-(now - last) / EWMA_DECAY)
+            self.ewma[server] = (value * weight + response_time * (1 - weight), now)
+
+    def stats(self):
+        with self.lock:
+            return {
+                server: {
+                    "outstanding": self.outstanding.get(server, 0),
+                    "ewma_ms": round(self.ewma.get(server, (0.0, 0))[0] * 1000, 2)
+                }
+                for server in self.servers
+            }
+
+class LeastOutstandingStrategy(BalancingStrategy):
+    """Elige el backend con menos peticiones en curso usando cubetas por número de peticiones"""
+
+    name = "least_outstanding"
+
+    def _rebuild(self):
+        self.buckets = defaultdict(dict)
+        for server in self.servers:
+            self.buckets[self.outstanding[server]][server] = None
+        # Cubeta no vacía más baja: los contadores cambian de uno en uno, así se mantiene en O(1)
+        self.min_count = min(self.buckets, default=0)
+
+    def _move(self, server, old, new):
+        bucket = self.buckets.get(old)
+        if bucket is not None and server in bucket:
+            del bucket[server]
+            if not bucket:
+                del self.buckets[old]
+                if old == self.min_count and new > old:
+                    self.min_count = new
+            self.buckets[new][server] = None
+            if new < self.min_count:
+                self.min_count = new
+
+    def select(self, is_available, tried, key=None):
+        with self.lock:
+            for server in self.buckets.get(self.min_count, ()):
+                if server not in tried and is_available(server):
+                    return server
+            # Solo si los menos cargados no están disponibles o ya se probaron
+            for count in sorted(self.buckets):
+                if count == self.min_count:
+                    continue
+                for server in self.buckets[count]:
+                    if server not in tried and is_available(server):
+                        return server
+        return None
+
+    def acquire(self, server):
+        with self.lock:
+            count = self.outstanding.get(server, 0)
+            self.outstanding[server] = count + 1
+            self._move(server, count, count + 1)
+
+    def release(self, server):
+        with self.lock:
+            count = self.outstanding.get(server, 0)
+            if count > 0:
+                self.outstanding[server] = count - 1
+                self._move(server, count, count - 1)
+
+class P2CEWMAStrategy(BalancingStrategy):
+    """Power of two choices: compara dos backends al azar por latencia EWMA y carga en curso"""
+
+    name = "p2c_ewma"
+
+    def _cost(self, server):
+        return (self.ewma[server][0] + 1e-3) * (self.outstanding[server] + 1)
+
+    def select(self, is_available, tried, key=None):
+        servers = self.servers
+        if len(servers) >= 2:
+            first, second = random.sample(servers, 2)
+            candidates = [s for s in (first, second) if s not in tried and is_available(s)]
+            if candidates:
+                with self.lock:
+                    return min(candidates, key=self._cost)
+        return self._fallback(is_available, tried)
+
+class WeightedRoundRobinStrategy(BalancingStrategy):
+    """Round-robin ponderado suave (como nginx) con la secuencia precalculada al cambiar los pesos"""
+
+    name = "weighted_round_robin"
+
+    def _rebuild(self):
+        weights = [(s, max(1, int(self.weights.get(s, 1)))) for s in self.servers]
+        total = sum(w for _, w in weights)
+        current = {s: 0 for s, _ in weights}
+        sequence = []
+        for _ in range(total):
+            for server, weight in weights:
+                current[server] += weight
+            best = max(current, key=current.get)
+            current[best] -= total
+            sequence.append(best)
+        self.sequence = sequence
+        self.counter = itertools.count()
+
+    def select(self, is_available, tried, key=None):
+        sequence = self.sequence
+        if not sequence:
+            return None
+        start = next(self.counter)
+        for offset in range(len(sequence)):
+            server = sequence[(start + offset) % len(sequence)]
+            if server not in tried and is_available(server):
+                return server
+        return None
+
+class RandomStrategy(BalancingStrategy):
+    """Elige un backend al azar"""
+
+    name = "random"
+
+    def select(self, is_available, tried, key=None):
+        if self.servers:
+            server = random.choice(self.servers)
+            if server not in tried and is_available(server):
+                return server
+        return self._fallback(is_available, tried)
+
+def ring_hash(value):
+    """Hash estable entre procesos (hash() de Python cambia en cada arranque)"""
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+class ConsistentHashStrategy(BalancingStrategy):
+    """Anillo de hash consistente con nodos virtuales: cada clave vuelve siempre al mismo backend"""
+
+    name = "consistent_hash"
+    uses_key = True
+
+    def __init__(self, servers, weights=None):
+        self.assignments = defaultdict(int)
+        self.remapped = 0
+        self.rebalances = deque(maxlen=50)
+        super().__init__(servers, weights)
+
+    def _rebuild(self):
+        ring = sorted(
+            (ring_hash(f"{server}#{i}"), server)
+            for server in self.servers
+            for i in range(VIRTUAL_NODES)
+        )
+        self.ring_hashes = [h for h, _ in ring]
+        self.ring_servers = [s for _, s in ring]
+        # Fracción del anillo que posee cada backend: el arco que termina en cada uno de sus nodos
+        self.shares = defaultdict(float)
+        space = float(2 ** 64)
+        for i, (h, server) in enumerate(ring):
+            previous = ring[i - 1][0] if i else ring[-1][0] - 2 ** 64
+            self.shares[server] += (h - previous) / space
+        self._record_rebalance(None, "ring_rebuilt")
+
+    def _record_rebalance(self, server, event):
+        self.rebalances.append({
+            "timestamp": datetime.now().strftime("%H:%M:%S"),
+            "server": server,
+            "event": event,
+            "key_share": round(self.shares.get(server, 1.0) * 100, 1) if server else 100.0
+        })
+
+    def select(self, is_available, tried, key=None):
+        if key is None or not self.ring_hashes:
+            return self._fallback(is_available, tried)
+        hashes, servers = self.ring_hashes, self.ring_servers
+        start = bisect.bisect(hashes, ring_hash(key))
+        home = None
+        seen = set()
+        for offset in range(len(servers)):
+            server = servers[(start + offset) % len(servers)]
+            if server in seen:
+                continue
+            seen.add(server)
+            if home is None:
+                home = server
+            if server not in tried and is_available(server):
+                with self.lock:
+                    self.assignments[server] += 1
+                    if server != home:
+                        self.remapped += 1
+                return server
+            if len(seen) == len(self.servers):
+                break
+        return None
+
+    def server_state_changed(self, server, available):
+        # Solo se mueven las claves del arco de este backend, que pasan al siguiente del anillo
+        with self.lock:
+            self._record_rebalance(server, "restored" if available else "removed")
+
+    def details(self):
+        with self.lock:
+            return {
+                "hash_key": HASH_KEY,
+                "virtual_nodes": VIRTUAL_NODES,
+                "sticky_assignments": dict(self.assignments),
+                "remapped_requests": self.remapped,
+                "key_share": {s: round(share * 100, 1) for s, share in self.shares.items()},
+                "rebalances": list(self.rebalances)[-10:]
+            }
+
+def routing_key():
+    """Clave de afinidad de la petición según HASH_KEY; si falta se usa la IP del cliente"""
+    kind, _, name = HASH_KEY.partition(':')
+    value = None
+    if kind == 'cookie':
+        value = request.cookies.get(name)
+    elif kind == 'header':
+        value = request.headers.get(name)
+    elif kind == 'path':
+        segments = int(name or 1)
+        value = '/'.join(request.path.strip('/').split('/')[:segments])
+    return value or request.remote_addr
+
+STRATEGIES = {
+    strategy.name: strategy
+    for strategy in (LeastOutstandingStrategy, P2CEWMAStrategy, WeightedRoundRobinStrategy,
+                     RandomStrategy, ConsistentHashStrategy)
+}
+
+balancer = STRATEGIES[BALANCING_STRATEGY](registry.snapshot.routable, registry.snapshot.weights)
+
+class CircuitBreaker:
+    """Circuito cerrado/abierto/semiabierto de un backend"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, server):
+        self.server = server
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.results = deque(maxlen=BREAKER_WINDOW)
+        self.window_failures = 0
+        self.consecutive_failures = 0
+        self.backoff = BREAKER_BASE_BACKOFF
+        self.open_until = 0.0
+        self.trials_in_flight = 0
+        self.trial_successes = 0
+        self.trips = 0
+        # Cambia en cada transición: los intentos admitidos antes ya no cuentan
+        self.generation = 0
+
+    def can_attempt(self):
+        """Consulta sin lock para las estrategias; la reserva real la hace acquire()"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return time.monotonic() >= self.open_until
+        return self.trials_in_flight < BREAKER_HALF_OPEN_TRIALS
+
+    def acquire(self):
+        """Reserva un intento; en semiabierto solo pasan BREAKER_HALF_OPEN_TRIALS a la vez.
+        Devuelve el token (generación, es_prueba) que luego se pasa a record()/cancel(), o None si no se admite"""
+        transition = None
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.monotonic() < self.open_until:
+                    return None
+                transition = self._set_state(self.HALF_OPEN)
+            token = (self.generation, False)
+            if self.state == self.HALF_OPEN:
+                if self.trials_in_flight < BREAKER_HALF_OPEN_TRIALS:
+                    self.trials_in_flight += 1
+                    token = (self.generation, True)
+                else:
+                    token = None
+        self._notify(transition)
+        return token
+
+    def cancel(self, token):
+        """Libera un intento reservado que no llegó a enviarse"""
+        with self.lock:
+            if self._is_trial(token):
+                self.trials_in_flight = max(0, self.trials_in_flight - 1)
+
+    def _is_trial(self, token):
+        return (token is not None and token[1] and token[0] == self.generation
+                and self.state == self.HALF_OPEN)
+
+    def record(self, success, token):
+        """Resultado de un intento. Los admitidos antes de la última transición (o forzados, sin token)
+        no cuentan: una respuesta lenta que llega tras abrirse el circuito no puede cerrarlo"""
+        transition = None
+        with self.lock:
+            if token is None or token[0] != self.generation:
+                return
+            if self.state == self.HALF_OPEN:
+                if not self._is_trial(token):
+                    return
+                self.trials_in_flight = max(0, self.trials_in_flight - 1)
+                if not success:
+                    transition = self._open(escalate=True)
+                else:
+                    self.trial_successes += 1
+                    if self.trial_successes >= BREAKER_HALF_OPEN_SUCCESSES:
+                        transition = self._set_state(self.CLOSED)
+            elif self.state == self.CLOSED:
+                if len(self.results) == self.results.maxlen and not self.results[0]:
+                    self.window_failures -= 1
+                self.results.append(success)
+                if success:
+                    self.consecutive_failures = 0
+                else:
+                    self.window_failures += 1
+                    self.consecutive_failures += 1
+                    if self.consecutive_failures >= BREAKER_CONSECUTIVE_FAILURES or (
+                            len(self.results) >= BREAKER_MIN_REQUESTS and
+                            self.window_failures / len(self.results) >= BREAKER_ERROR_RATE):
+                        transition = self._open(escalate=False)
+        self._notify(transition)
+
+    def record_probe(self, healthy):
+        """Un health check correcto adelanta la fase de prueba y, en semiabierto, cuenta como prueba superada
+        (sin tráfico de clientes el circuito también se cierra); uno fallido abre el circuito"""
+        transition = None
+        with self.lock:
+            if healthy and self.state == self.OPEN:
+                transition = self._set_state(self.HALF_OPEN)
+            elif healthy and self.state == self.HALF_OPEN:
+                self.trial_successes += 1
+                if self.trial_successes >= BREAKER_HALF_OPEN_SUCCESSES:
+                    transition = self._set_state(self.CLOSED)
+            elif not healthy and self.state != self.OPEN:
+                transition = self._open(escalate=self.state == self.HALF_OPEN)
+        self._notify(transition)
+
+    def trip(self):
+        with self.lock:
+            transition = self._open(escalate=False) if self.state != self.OPEN else None
+        self._notify(transition)
+
+    def _open(self, escalate):
+        self.backoff = min(self.backoff * 2, BREAKER_MAX_BACKOFF) if escalate else BREAKER_BASE_BACKOFF
+        self.open_until = time.monotonic() + self.backoff
+        self.trips += 1
+        return self._set_state(self.OPEN)
+
+    def _set_state(self, new_state):
+        old_state, self.state = self.state, new_state
+        self.generation += 1
+        self.trials_in_flight = 0
+        self.trial_successes = 0
+        if new_state == self.CLOSED:
+            self.results.clear()
+            self.window_failures = 0
+            self.consecutive_failures = 0
+        return old_state, new_state
+
+    def _notify(self, transition):
+        # Fuera del lock: avisar a la estrategia toma sus propios locks
+        if transition is None:
+            return
+        old_state, new_state = transition
+        circuit_events.append({
+            "timestamp": datetime.now().strftime("%H:%M:%S"),
+            "server": self.server,
+            "from": old_state,
+            "to": new_state
+        })
+        if new_state == self.OPEN:
+            mark_server_failed(self.server)
+            logger.warning(f"❌ Circuito abierto para {self.server}: reintento en {self.backoff}s")
+        elif new_state == self.HALF_OPEN:
+            logger.info(f"🟡 Circuito semiabierto para {self.server}: enviando tráfico de prueba")
+        elif mark_server_recovered(self.server):
+            logger.info(f"⚡ Servidor {self.server} recuperado: circuito cerrado")
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "error_rate": round(self.window_failures / max(len(self.results), 1) * 100, 1),
+                "backoff_seconds": self.backoff,
+                "trips": self.trips
+            }
+            if self.state == self.OPEN:
+                stats["retry_in"] = max(0, round(self.open_until - time.monotonic(), 1))
+            elif self.state == self.HALF_OPEN:
+                stats["trials_in_flight"] = self.trials_in_flight
+                stats["trial_successes"] = self.trial_successes
+            return stats
+
+class CircuitBreakers:
+    """Registro de circuit breakers, uno por backend"""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, server):
+        breaker = self._breakers.get(server)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(server)
+                if breaker is None:
+                    breaker = self._breakers[server] = CircuitBreaker(server)
+        return breaker
+
+    def remove(self, server):
+        with self._lock:
+            self._breakers.pop(server, None)
+
+breakers = CircuitBreakers()
+circuit_events = deque(maxlen=50)
+
+def apply_registry_change(snapshot, removed):
+    """La estrategia se reconstruye con los backends enrutables; lo de los eliminados se descarta"""
+    balancer.set_servers(snapshot.routable, snapshot.weights)
+    for server in removed:
+        state.failed_servers.pop(server, None)
+        probe_schedules.pop(server, None)
+        breakers.remove(server)
+        pools.remove(server)
+    logger.info(f"🗂️ Backends actualizados (v{snapshot.version}): "
+                f"{len(snapshot.routable)} enrutables de {len(snapshot.servers)}")
+
+registry.subscribe(apply_registry_change)
+
+def is_server_available(server):
+    """Un backend admite tráfico si su circuito está cerrado o puede hacer una prueba"""
+    return breakers.get(server).can_attempt()
+
+def can_take_request(server):
+    return is_server_available(server) and admission.has_capacity(server)
+
+class BackendsSaturated(Exception):
+    """Hay backends sanos sin probar, pero todos están en su límite de peticiones en curso"""
+
+def select_server(tried, key=None):
+    """Elige el backend del siguiente intento y reserva el intento en su circuito; devuelve
+    (servidor, token del circuito). Si no hay ninguno activo, prueba con todos (sin token)"""
+    while True:
+        server = balancer.select(can_take_request, tried, key)
+        if server is None:
+            break
+        token = breakers.get(server).acquire()
+        if token is not None:
+            return server, token
+        # Otro hilo ocupó las plazas de prueba del circuito semiabierto
+        tried.add(server)
+    if any(s not in tried and is_server_available(s) for s in registry.snapshot.routable):
+        raise BackendsSaturated()
+    if not tried:
+        logger.error("¡ALERTA! No hay servidores activos disponibles. Intentando con todos.")
+        server = balancer.select(lambda s: True, tried, key)
+    return server, None
+
+class AdaptiveLimit:
+    """Límite de concurrencia de un backend por gradiente: límite * (latencia mínima / latencia actual)"""
+
+    __slots__ = ('lock', 'limit', 'min_latency', 'smoothed', 'reset_at')
+
+    def __init__(self):
+        # Propio de cada backend: las respuestas no compiten con la cola de admisión ni con otros backends
+        self.lock = threading.Lock()
+        self.limit = float(BACKEND_MAX_IN_FLIGHT)
+        self.min_latency = None
+        self.smoothed = None
+        self.reset_at = 0.0
+
+    def observe(self, latency):
+        with self.lock:
+            self._observe(latency)
+
+    def _observe(self, latency):
+        now = time.monotonic()
+        # La mínima se renueva cada ventana para que el límite pueda volver a subir
+        if self.min_latency is None or latency < self.min_latency or now >= self.reset_at:
+            self.min_latency = max(latency, ADAPTIVE_LATENCY_FLOOR)
+            if now >= self.reset_at:
+                self.reset_at = now + ADAPTIVE_MIN_LATENCY_WINDOW
+        self.smoothed = latency if self.smoothed is None else self.smoothed * 0.9 + latency * 0.1
+        gradient = max(0.5, min(1.0, ADAPTIVE_TOLERANCE * self.min_latency / max(self.smoothed, ADAPTIVE_LATENCY_FLOOR)))
+        target = self.limit * gradient + math.sqrt(self.limit)
+        self.limit = max(ADAPTIVE_MIN_LIMIT, min(BACKEND_MAX_IN_FLIGHT, self.limit * 0.8 + target * 0.2))
+
+class AdmissionController:
+    """Límite global y por backend de peticiones en curso, con cola de espera acotada y con plazo"""
+
+    def __init__(self):
+        # Cola global; quien espera hueco en un backend usa su propia condición
+        self.cond = threading.Condition()
+        self.backend_cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.waiting_backend = 0
+        self.limits = {}
+        self.limits_lock = threading.Lock()
+        self.admitted = 0
+        self.queued = 0
+        self.queued_backend = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.rejected_saturated = 0
+
+    def acquire(self):
+        """Reserva una plaza global; False si la petición debe rechazarse"""
+        with self.cond:
+            if self.in_flight < ADMISSION_MAX_IN_FLIGHT and not self.waiting:
+                self.in_flight += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= ADMISSION_QUEUE_SIZE:
+                self.rejected_queue_full += 1
+                return False
+            deadline = time.monotonic() + ADMISSION_QUEUE_TIMEOUT
+            self.waiting += 1
+            self.queued += 1
+            try:
+                while self.in_flight >= ADMISSION_MAX_IN_FLIGHT:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected_timeout += 1
+                        return False
+                    self.cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self.cond:
+            self.in_flight -= 1
+            # Se libera una sola plaza: basta con despertar a un único hilo de la cola
+            if self.waiting:
+                self.cond.notify()
+        # Lectura sin lock: si se cuela un hilo que acaba de ponerse a esperar, lo despierta su sondeo
+        if self.waiting_backend:
+            with self.backend_cond:
+                self.backend_cond.notify_all()
+
+    def wait_for_backend(self, deadline, ready):
+        """Espera a que ready() indique un backend con hueco; False si se acabó el plazo.
+        La petición cuenta una sola vez en la cola, aunque se despierte varias veces"""
+        with self.backend_cond:
+            self.waiting_backend += 1
+            self.queued_backend += 1
+            try:
+                while not ready():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected_saturated += 1
+                        return False
+                    # Los límites adaptativos también cambian sin release(): se vuelve a mirar cada poco
+                    self.backend_cond.wait(min(remaining, 0.05))
+                return True
+            finally:
+                self.waiting_backend -= 1
+
+    def backend_limit(self, server):
+        if not ADAPTIVE_LIMIT_ENABLED:
+            return BACKEND_MAX_IN_FLIGHT
+        limit = self.limits.get(server)
+        return BACKEND_MAX_IN_FLIGHT if limit is None else int(limit.limit)
+
+    def has_capacity(self, server):
+        return balancer.outstanding.get(server, 0) < self.backend_limit(server)
+
+    def observe(self, server, latency):
+        if not ADAPTIVE_LIMIT_ENABLED:
+            return
+        limit = self.limits.get(server)
+        if limit is None:
+            with self.limits_lock:
+                limit = self.limits.get(server)
+                if limit is None:
+                    limit = self.limits[server] = AdaptiveLimit()
+        limit.observe(latency)
+
+    def stats(self):
+        with self.backend_cond:
+            waiting_backend = self.waiting_backend
+            queued_backend = self.queued_backend
+            rejected_saturated = self.rejected_saturated
+        with self.cond:
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": ADMISSION_MAX_IN_FLIGHT,
+                "waiting": self.waiting,
+                "waiting_backend": waiting_backend,
+                "admitted": self.admitted,
+                "queued": self.queued + queued_backend,
+                "rejected_queue_full": self.rejected_queue_full,
+                "rejected_timeout": self.rejected_timeout,
+                "rejected_saturated": rejected_saturated,
+                "adaptive": ADAPTIVE_LIMIT_ENABLED
+            }
+
+admission = AdmissionController()
+
+class AdmissionTicket:
+    """Plaza global de una petición; se libera una sola vez, al terminar la respuesta"""
 
-    for server in SERVERS:
-        if server not in state.failed_servers or current_time - state.failed_servers[server] > RETRY_INTERVAL:
-            active_servers.append(server)
+    __slots__ = ('released', 'streaming')
+
+    def __init__(self):
+        self.released = False
+        self.streaming = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            admission.release()
+
+def overloaded_response():
+    response = Response("🚦 El balanceador está saturado. Reintenta en unos segundos.", 503)
+    response.headers['Retry-After'] = str(ADMISSION_RETRY_AFTER)
+    return response
+
+def retry_budget_response():
+    """503 cuando falló el intento y el presupuesto de reintentos no deja probar otros backends
+    (que pueden estar sanos): no es una caída total, el cliente puede volver cuando se repongan fichas"""
+    response = Response("🚦 La petición falló y se agotó el presupuesto de reintentos (retry budget exhausted). "
+                        "Reintenta en unos segundos.", 503)
+    response.headers['Retry-After'] = str(max(1, math.ceil(1 / RETRY_BUDGET_MIN_PER_SECOND)))
+    return response
+
+def mark_server_failed(server):
+    """Marca un backend como caído (o renueva la marca) y avisa a la estrategia"""
+    if server not in state.failed_servers:
+        balancer.server_state_changed(server, False)
+    state.failed_servers[server] = time.time()
+
+def mark_server_recovered(server):
+    """Quita la marca de caído; devuelve True si el backend estaba marcado"""
+    if state.failed_servers.pop(server, None) is None:
+        return False
+    state.uptime_start[server] = datetime.now()
+    balancer.server_state_changed(server, True)
+    return True
 
-    if active_servers:
-        active_servers.sort(key=lambda s: state.server_stats[s]['total_requests'])
-        return active_servers
+class ProbeSchedule:
+    """Cuándo toca sondear un backend: más a menudo si oscila, menos si lleva tiempo estable"""
 
-    logger.error("¡ALERTA! No hay servidores activos disponibles. Intentando con todos.")
-    return SERVERS
+    def __init__(self):
+        self.interval = HEALTH_CHECK_INTERVAL
+        # El primer sondeo cae en un punto al azar para no alinearse con otros balanceadores
+        self.next_due = time.monotonic() + random.uniform(0, HEALTH_CHECK_INTERVAL)
+        self.results = deque(maxlen=HEALTH_FLAP_WINDOW)
+        self.in_flight = False
+
+    @property
+    def flapping(self):
+        results = list(self.results)
+        return sum(1 for a, b in zip(results, results[1:]) if a != b) >= 2
+
+    def update(self, healthy):
+        self.results.append(healthy)
+        if self.flapping:
+            self.interval = HEALTH_CHECK_MIN_INTERVAL
+        elif healthy and len(self.results) == self.results.maxlen and all(self.results):
+            self.interval = min(self.interval * 1.5, HEALTH_CHECK_MAX_INTERVAL)
+        else:
+            self.interval = HEALTH_CHECK_INTERVAL
+        self.schedule(self.interval)
+
+    def schedule(self, delay):
+        jitter = random.uniform(1 - HEALTH_CHECK_JITTER, 1 + HEALTH_CHECK_JITTER)
+        self.next_due = time.monotonic() + delay * jitter
+
+probe_schedules = {}
+
+def expedite_probe(server):
+    """Adelanta el próximo health check de un backend (p. ej. tras un fallo de tráfico real)"""
+    schedule = probe_schedules.get(server)
+    if schedule is not None and not schedule.in_flight:
+        schedule.schedule(HEALTH_CHECK_MIN_INTERVAL)
+
+def run_probe(server):
+    schedule = probe_schedules.get(server)
+    if schedule is None:
+        # Se eliminó el backend mientras el sondeo esperaba en el pool
+        return
+    try:
+        is_healthy = check_server_health(server)
+        breakers.get(server).record_probe(is_healthy)
+        schedule.update(is_healthy)
+    finally:
+        schedule.in_flight = False
 
 def health_check_loop():
-    """Función que verifica periódicamente el estado de los servidores"""
+    """Lanza en paralelo los health checks que van tocando según el calendario de cada backend"""
+    with ThreadPoolExecutor(max_workers=HEALTH_CHECK_WORKERS, thread_name_prefix="health") as executor:
+        while True:
+            now = time.monotonic()
+            next_wake = now + 1
+            for server in registry.snapshot.servers:
+                schedule = probe_schedules.get(server)
+                if schedule is None:
+                    schedule = probe_schedules[server] = ProbeSchedule()
+                if schedule.in_flight:
+                    continue
+                if schedule.next_due <= now:
+                    schedule.in_flight = True
+                    executor.submit(run_probe, server)
+                else:
+                    next_wake = min(next_wake, schedule.next_due)
+            time.sleep(max(0.05, next_wake - time.monotonic()))
+
+class UpstreamStream:
+    """Reenvía el cuerpo del backend por bloques y devuelve la conexión al pool al terminar.
+    Si el backend falla a mitad del cuerpo se avisa a on_error y se relanza el error: el servidor corta
+    la conexión en vez de dar por buena una respuesta truncada"""
+
+    def __init__(self, resp, url, on_close=None, captures=(), on_error=None):
+        self.resp = resp
+        self.url = url
+        self.on_close = on_close
+        self.on_error = on_error
+        # Copias del cuerpo (caché, peticiones agrupadas) que solo se completan si llega entero
+        self.captures = [capture for capture in captures if capture is not None]
+        self.closed = False
+
+    def __iter__(self):
+        try:
+            for chunk in self.resp.iter_content(STREAM_CHUNK_SIZE):
+                if chunk:
+                    for capture in self.captures:
+                        capture.feed(chunk)
+                    yield chunk
+            for capture in self.captures:
+                capture.finish()
+        except Exception as e:
+            logger.error(f"❌ Error leyendo la respuesta de {self.url}: {str(e)}")
+            if self.on_error:
+                self.on_error()
+            raise
+        finally:
+            self.close()
+
+    def close(self):
+        # Werkzeug llama a close() también si el cliente se desconecta antes de leer
+        if self.closed:
+            return
+        self.closed = True
+        self.resp.close()
+        for capture in self.captures:
+            capture.abort()
+        if self.on_close:
+            self.on_close()
+
+class CacheEntry:
+    """Respuesta guardada en la caché del balanceador"""
+
+    __slots__ = ('status', 'headers', 'body', 'etag', 'upstream_etag', 'vary', 'group',
+                 'stored_at', 'expires_at', 'size')
+
+    def __init__(self, status, headers, body, upstream_etag, vary, group, ttl):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.upstream_etag = upstream_etag
+        self.etag = upstream_etag or '"' + hashlib.md5(body).hexdigest() + '"'
+        self.vary = vary
+        self.group = group
+        self.stored_at = time.monotonic()
+        self.expires_at = self.stored_at + ttl
+        self.size = len(body) + sum(len(k) + len(v) for k, v in headers)
+
+class ResponseCache:
+    """Caché LRU acotada en bytes para respuestas GET, invalidada por grupos al escribir"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        # Cada invalidación sube la generación del grupo: un GET que empezó antes no puede guardar
+        self.generations = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.revalidations = 0
+
+    def generation(self, group):
+        with self.lock:
+            return self.generations[group]
+
+    def lookup(self, key, request_headers):
+        """Devuelve (entrada, fresca) o (None, False)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and any(request_headers.get(name) != value for name, value in entry.vary):
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None, False
+            self.entries.move_to_end(key)
+            if time.monotonic() < entry.expires_at:
+                self.hits += 1
+                return entry, True
+            self.misses += 1
+            return entry, False
+
+    def store(self, key, generation, entry):
+        with self.lock:
+            if self.generations[entry.group] != generation or entry.size > CACHE_MAX_ENTRY_BYTES:
+                return
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous.size
+            self.entries[key] = entry
+            self.size += entry.size
+            while self.size > CACHE_MAX_BYTES and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+
+    def refresh(self, entry, ttl):
+        """El backend confirmó con 304 que la entrada sigue valiendo"""
+        with self.lock:
+            entry.expires_at = time.monotonic() + ttl
+            self.revalidations += 1
+
+    def invalidate(self, group):
+        with self.lock:
+            self.generations[group] += 1
+            stale = [key for key, entry in self.entries.items() if entry.group == group]
+            for key in stale:
+                self.size -= self.entries.pop(key).size
+            self.invalidations += len(stale)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": CACHE_ENABLED,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": CACHE_MAX_BYTES,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups * 100, 1) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "revalidations": self.revalidations
+            }
+
+response_cache = ResponseCache()
+
+def parse_cache_control(value):
+    directives = {}
+    for part in value.split(','):
+        name, _, argument = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"')
+    return directives
+
+def negotiate_encoding(accept_encoding, available):
+    """Codificación preferida por el cliente entre las disponibles (br > gzip > identity a igual q)"""
+    weights = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding.strip().lower()] = q
+    best, best_q = 'identity', 0.0
+    for coding in ('br', 'gzip'):
+        q = weights.get(coding, weights.get('*', 0.0))
+        if coding in available and q > best_q:
+            best, best_q = coding, q
+    return best
+
+def etag_matches(if_none_match, etag):
+    """Comparación débil de If-None-Match (W/"x" equivale a "x")"""
+    if if_none_match.strip() == '*':
+        return True
+    etag = etag.removeprefix('W/')
+    return etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+
+def cache_ttl(resp, revalidated=False, authenticated=False):
+    """Segundos que se puede guardar la respuesta según su Cache-Control, o None si no se puede.
+    La respuesta a una petición con credenciales solo se guarda si es "public" y dice cuánto tiempo"""
+    if not revalidated and resp.status_code != 200:
+        return None
+    if 'Set-Cookie' in resp.headers or resp.headers.get('Vary') == '*':
+        return None
+    directives = parse_cache_control(resp.headers.get('Cache-Control', ''))
+    if 'no-store' in directives or 'private' in directives:
+        return None
+    if authenticated and 'public' not in directives:
+        return None
+    if 'no-cache' in directives:
+        return 0
+    for name in ('s-maxage', 'max-age'):
+        if name in directives:
+            try:
+                return max(0, int(directives[name]))
+            except ValueError:
+                return None
+    return None if authenticated else CACHE_DEFAULT_TTL
+
+def cache_key_for_request():
+    return (request.full_path,) + tuple(request.headers.get(name) for name in CACHE_KEY_HEADERS)
+
+class CacheFill:
+    """Copia el cuerpo que se va reenviando al cliente y lo guarda al terminar si cabe"""
+
+    def __init__(self, key, generation, group, resp, request_headers, ttl):
+        self.key = key
+        self.generation = generation
+        self.group = group
+        self.status = resp.status_code
+        self.headers = [(k, v) for k, v in upstream_headers(resp)
+                        if k.lower() not in ('content-length', 'etag', 'date')]
+        self.upstream_etag = resp.headers.get('ETag')
+        vary = [name.strip() for name in resp.headers.get('Vary', '').split(',') if name.strip()]
+        self.vary = tuple((name, request_headers.get(name)) for name in vary)
+        self.ttl = ttl
+        self.chunks = []
+        self.size = 0
+        self.overflow = False
+
+    def feed(self, chunk):
+        if self.overflow:
+            return
+        self.size += len(chunk)
+        if self.size > CACHE_MAX_ENTRY_BYTES:
+            self.overflow = True
+            self.chunks = []
+        else:
+            self.chunks.append(chunk)
+
+    def finish(self):
+        if not self.overflow:
+            entry = CacheEntry(self.status, self.headers, b''.join(self.chunks),
+                               self.upstream_etag, self.vary, self.group, self.ttl)
+            response_cache.store(self.key, self.generation, entry)
+        self.chunks = []
+
+    def abort(self):
+        self.chunks = []
+
+def cached_response(entry):
+    """Respuesta servida desde la caché (304 si el cliente ya tiene esa versión)"""
+    if etag_matches(request.headers.get('If-None-Match', ''), entry.etag):
+        response = Response(status=304)
+    else:
+        response = Response(entry.body, entry.status, entry.headers)
+    response.headers['ETag'] = entry.etag
+    response.headers['Age'] = str(int(time.monotonic() - entry.stored_at))
+    response.headers['X-Cache'] = "HIT"
+    response.headers['X-Load-Balancer'] = "TaskFlow-LB/2.0"
+    return response
+
+def route_group(routes, path, prefix=False):
+    if prefix:
+        return next((group for route, group in routes.items() if path.startswith(route)), None)
+    return routes.get(path)
+
+class InFlightCall:
+    """GET en curso al que se pueden sumar peticiones idénticas"""
+
+    __slots__ = ('done', 'result')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+class SingleFlight:
+    """Agrupa GET idénticos concurrentes: el primero va al backend y el resto espera su respuesta"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.fallbacks = 0
+
+    def join(self, key):
+        """Devuelve (llamada, es_líder)"""
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                return call, False
+            call = self.calls[key] = InFlightCall()
+            self.leaders += 1
+            return call, True
+
+    def wait(self, call):
+        """Resultado compartido del líder, o None si hay que ir al backend por cuenta propia"""
+        finished = call.done.wait(COALESCE_MAX_WAIT)
+        with self.lock:
+            if not finished:
+                self.timeouts += 1
+            elif call.result is None:
+                self.fallbacks += 1
+            else:
+                self.coalesced += 1
+        return call.result if finished else None
+
+    def complete(self, key, call, result=None):
+        with self.lock:
+            if self.calls.get(key) is call:
+                del self.calls[key]
+        if not call.done.is_set():
+            call.result = result
+            call.done.set()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": COALESCE_ENABLED,
+                "in_flight": len(self.calls),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "timeouts": self.timeouts,
+                "fallbacks": self.fallbacks
+            }
+
+single_flight = SingleFlight()
+
+def coalesce_key():
+    return (request.method, request.full_path) + tuple(request.headers.get(name) for name in COALESCE_KEY_HEADERS)
+
+class FlightFill:
+    """Copia la respuesta del líder para entregársela a las peticiones que esperan"""
+
+    def __init__(self, key, call):
+        self.key = key
+        self.call = call
+        self.attached = False
+        self.chunks = []
+        self.size = 0
+        self.overflow = False
+
+    def attach(self, status, headers):
+        # Una respuesta con Set-Cookie es de un cliente concreto: los demás van al backend
+        self.attached = True
+        self.status = status
+        self.headers = headers
+        self.overflow = any(k.lower() == 'set-cookie' for k, _ in headers)
+
+    def feed(self, chunk):
+        if self.overflow:
+            return
+        self.size += len(chunk)
+        if self.size > COALESCE_MAX_BODY_BYTES:
+            self.overflow = True
+            self.chunks = []
+        else:
+            self.chunks.append(chunk)
+
+    def finish(self):
+        result = None if self.overflow else (self.status, self.headers, b''.join(self.chunks))
+        self.chunks = []
+        single_flight.complete(self.key, self.call, result)
+
+    def abort(self):
+        self.chunks = []
+        single_flight.complete(self.key, self.call)
+
+def coalesced_response(result):
+    status, headers, body = result
+    response = Response(body, status, headers)
+    response.headers['X-Coalesced'] = "true"
+    return response
+
+class BodyNotReplayable(Exception):
+    """El cuerpo ya se envió en parte y no cabe en el buffer de reintento"""
+
+class RequestBody:
+    """Cuerpo del cliente leído bajo demanda, con un buffer acotado para reenviarlo en un failover"""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.length = length
+        self.limit = REPLAY_BUFFER_SIZE
+        self.buffer = bytearray()
+        self.consumed = 0
+        self.overflowed = False
+        self.client_error = None
+
+    def reader(self):
+        """Nuevo lector desde el primer byte; falla si parte del cuerpo ya no está en el buffer"""
+        if self.overflowed:
+            raise BodyNotReplayable(f"el cuerpo supera {self.limit} bytes y ya se envió en parte")
+        return _BodyReader(self)
+
+    def _read_stream(self, amt):
+        try:
+            chunk = self.stream.read(amt)
+        except Exception as e:
+            self.client_error = e
+            raise
+        self.consumed += len(chunk)
+        if not self.overflowed:
+            if len(self.buffer) + len(chunk) <= self.limit:
+                self.buffer += chunk
+            else:
+                self.overflowed = True
+                self.buffer = bytearray()
+        return chunk
+
+class _BodyReader:
+    """Objeto tipo fichero que requests envía al backend por bloques"""
+
+    def __init__(self, body):
+        self.body = body
+        self.pos = 0
+        # requests usa `len` para decidir entre Content-Length y chunked
+        self.len = body.length
+
+    def read(self, amt=-1):
+        if amt is None or amt < 0:
+            return b''.join(iter(lambda: self.read(STREAM_CHUNK_SIZE), b''))
+        body = self.body
+        if self.pos < body.consumed:
+            chunk = bytes(body.buffer[self.pos:self.pos + amt])
+        else:
+            chunk = body._read_stream(amt)
+        self.pos += len(chunk)
+        return chunk
+
+    def __iter__(self):
+        return iter(lambda: self.read(STREAM_CHUNK_SIZE), b'')
+
+def upstream_headers(resp):
+    """Cabeceras del backend que se pueden reenviar tal cual al cliente"""
+    # requests descomprime el cuerpo, así que con content-encoding el tamaño original ya no vale
+    excluded = HOP_BY_HOP_HEADERS
+    if 'content-encoding' in resp.headers:
+        excluded += ('content-encoding', 'content-length')
+    return [(k, v) for k, v in resp.headers.items() if k.lower() not in excluded]
+
+class CompressionStats:
+    """Bytes antes y después de comprimir y tiempo de CPU gastado, por codificación"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.encodings = {}
+        self.skipped = defaultdict(int)
+
+    def record(self, encoding, bytes_in, bytes_out, cpu_seconds):
+        with self.lock:
+            stats = self.encodings.get(encoding)
+            if stats is None:
+                stats = self.encodings[encoding] = {"responses": 0, "bytes_in": 0, "bytes_out": 0, "cpu_seconds": 0.0}
+            stats["responses"] += 1
+            stats["bytes_in"] += bytes_in
+            stats["bytes_out"] += bytes_out
+            stats["cpu_seconds"] += cpu_seconds
+
+    def skip(self, reason):
+        with self.lock:
+            self.skipped[reason] += 1
+
+    def stats(self):
+        with self.lock:
+            encodings = {
+                encoding: {
+                    **stats,
+                    "cpu_seconds": round(stats["cpu_seconds"], 4),
+                    "ratio": round(stats["bytes_out"] / stats["bytes_in"], 3) if stats["bytes_in"] else 0.0,
+                    "cpu_ms_per_mb": round(stats["cpu_seconds"] * 1000 / (stats["bytes_in"] / 1e6), 2)
+                                     if stats["bytes_in"] else 0.0
+                }
+                for encoding, stats in self.encodings.items()
+            }
+            return {"enabled": COMPRESSION_ENABLED, "brotli_available": brotli is not None,
+                    "encodings": encodings, "skipped": dict(self.skipped)}
+
+compression_stats = CompressionStats()
+
+class CompressingStream:
+    """Comprime al vuelo los bloques de una respuesta sin cargarla entera en memoria"""
+
+    def __init__(self, iterable, encoding):
+        self.iterable = iterable
+        self.encoding = encoding
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self.compress, self.finish = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+            self.compress, self.finish = compressor.compress, compressor.flush
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+        self.closed = False
+
+    def _timed(self, func, *args):
+        start = time.thread_time()
+        data = func(*args)
+        self.cpu_seconds += time.thread_time() - start
+        self.bytes_out += len(data)
+        return data
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            self.bytes_in += len(chunk)
+            data = self._timed(self.compress, chunk)
+            if data:
+                yield data
+        data = self._timed(self.finish)
+        if data:
+            yield data
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if hasattr(self.iterable, 'close'):
+            self.iterable.close()
+        compression_stats.record(self.encoding, self.bytes_in, self.bytes_out, self.cpu_seconds)
+
+def pool_eviction_loop():
+    """Cierra periódicamente las conexiones keep-alive ociosas"""
     while True:
-        for server in SERVERS:
-            is_healthy = check_server_health(server)
+        time.sleep(POOL_EVICT_INTERVAL)
+        evicted = pools.evict_idle()
+        if evicted:
+            logger.info(f"🔌 {evicted} conexiones ociosas cerradas")
 
-            if is_healthy and server in state.failed_servers:
-                del state.failed_servers[server]
-                state.server_stats[server]['uptime_start'] = datetime.now()
-                logger.info(f"⚡ Health check: Servidor {server} recuperado y vuelve a estar activo")
-            elif not is_healthy and server not in state.failed_servers:
-                state.failed_servers[server] = time.time()
-                logger.warning(f"❌ Health check: Servidor {server} detectado como caído")
+class ClientBodyError(Exception):
+    """El cliente cortó el envío del cuerpo mientras se reenviaba al backend"""
 
-        time.sleep(HEALTH_CHECK_INTERVAL)
+class RetryBudget:
+    """Cubo de fichas: cada petición aporta RETRY_BUDGET_RATIO y cada reintento o hedge gasta una"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = float(RETRY_BUDGET_MAX_TOKENS)
+        self.last_refill = time.monotonic()
+        self.granted = 0
+        self.rejected = 0
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(RETRY_BUDGET_MAX_TOKENS, self.tokens + RETRY_BUDGET_RATIO)
+
+    def withdraw(self):
+        with self.lock:
+            # Un mínimo por segundo para que con poco tráfico aún se pueda reintentar
+            now = time.monotonic()
+            self.tokens = min(RETRY_BUDGET_MAX_TOKENS,
+                              self.tokens + (now - self.last_refill) * RETRY_BUDGET_MIN_PER_SECOND)
+            self.last_refill = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.granted += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def stats(self):
+        with self.lock:
+            return {
+                "ratio": RETRY_BUDGET_RATIO,
+                "tokens": round(self.tokens, 2),
+                "granted": self.granted,
+                "rejected": self.rejected
+            }
+
+retry_budget = RetryBudget()
+hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+hedge_stats = {"sent": 0, "won": 0}
+hedge_stats_lock = threading.Lock()
+
+def send_upstream(server, token, path, method, headers, cookies, params, data=None, body=None, attempt=None):
+    """Un intento contra un backend; registra el resultado (con el token de su circuito) y devuelve (respuesta, tiempo)"""
+    url = f"{server}/{path}"
+    balancer.acquire(server)
+    start_time = time.time()
+    current_attempt.attempt = attempt
+    try:
+        resp = pools.get(server).session.request(
+            method=method,
+            url=url,
+            headers=headers,
+            data=data,
+            cookies=cookies,
+            params=params,
+            allow_redirects=False,
+            stream=True,
+            timeout=UPSTREAM_TIMEOUT
+        )
+    except Exception as e:
+        response_time = time.time() - start_time
+        balancer.release(server)
+        if body is not None and body.client_error:
+            breakers.get(server).cancel(token)
+            raise ClientBodyError(str(body.client_error)) from e
+        if attempt is not None and attempt.aborted:
+            # Lo cortó el hedge que ganó: no es un fallo del backend
+            breakers.get(server).cancel(token)
+            raise
+        state.add_request(server, False, response_time, f"/{path}")
+        # Un fallo rápido (conexión rechazada) no debe parecer un backend veloz
+        balancer.observe(server, max(response_time, UPSTREAM_TIMEOUT))
+        admission.observe(server, max(response_time, UPSTREAM_TIMEOUT))
+        logger.error(f"❌ Error al conectar con {server}: {str(e)}")
+        breakers.get(server).record(False, token)
+        expedite_probe(server)
+        raise
+    finally:
+        current_attempt.attempt = None
+
+    response_time = time.time() - start_time
+    state.add_request(server, True, response_time, f"/{path}", resp.status_code)
+    balancer.observe(server, response_time)
+    admission.observe(server, response_time)
+    breakers.get(server).record(resp.status_code < 500, token)
+
+    access_log(server, method, path, resp.status_code, response_time)
+    return resp, response_time
+
+def access_log(server, method, path, status, response_time):
+    """Log de acceso muestreado: las respuestas < 400 solo se escriben con probabilidad LOG_SUCCESS_SAMPLE_RATE"""
+    if status < 400 and random.random() >= LOG_SUCCESS_SAMPLE_RATE:
+        with log_stats_lock:
+            log_stats["sampled_out"] += 1
+        return
+    icon = "✅" if status < 400 else "⚠️"
+    logger.info(f"{icon} {method} {server}/{path} -> {status} ({response_time:.3f}s)", extra={"fields": {
+        "server": server,
+        "method": method,
+        "path": f"/{path}",
+        "status": status,
+        "response_time_ms": round(response_time * 1000, 2)
+    }})
+
+def hedge_delay(server, path):
+    """Espera antes de lanzar el hedge: percentil de latencia de la ruta (o del backend)"""
+    histogram = state.route_latency.get(route_label(f"/{path}")) or state.server_latency.get(server)
+    delay = histogram.quantile(HEDGE_PERCENTILE) if histogram else None
+    if delay is None:
+        return HEDGE_DEFAULT_DELAY
+    return max(HEDGE_MIN_DELAY, delay)
+
+class HedgeTimer:
+    """Un único hilo que lanza los hedges a su hora, en vez de un hilo (o un worker) esperando por petición"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.heap = []
+        self.sequence = itertools.count()
+        self.thread = None
+
+    def schedule(self, delay, callback):
+        entry = [time.monotonic() + delay, next(self.sequence), callback]
+        with self.cond:
+            heapq.heappush(self.heap, entry)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="hedge-timer", daemon=True)
+                self.thread.start()
+            self.cond.notify()
+        return entry
+
+    def cancel(self, entry):
+        with self.cond:
+            entry[2] = None
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.cond.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                callback = heapq.heappop(self.heap)[2]
+            if callback is not None:
+                try:
+                    callback()
+                except Exception:
+                    logger.exception("❌ Error lanzando un hedge")
+
+hedge_timer = HedgeTimer()
+
+class UpstreamAttempt:
+    """Un intento de una carrera con hedge: guarda su conexión para poder cortarlo si pierde"""
+
+    def __init__(self, on_connect=None):
+        self.on_connect = on_connect
+        self.conn = None
+        self.aborted = False
+
+    def connected(self, conn):
+        self.conn = conn
+        if self.on_connect is not None:
+            self.on_connect()
+            self.on_connect = None
+
+    def abort(self):
+        self.aborted = True
+        sock = getattr(self.conn, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+def discard_response(server, resp):
+    """Cierra la respuesta del intento que pierde la carrera"""
+    resp.close()
+    balancer.release(server)
+
+class HedgedRequest:
+    """Carrera entre el intento principal, que va en el hilo de la petición, y un hedge en hedge_executor.
+    El hedge se programa desde que el principal tiene conexión (cuando de verdad se envía), así que ni la
+    espera en cola ni el pool de hedges cuentan como latencia del backend"""
+
+    def __init__(self, server, token, tried, key, upstream_args):
+        self.server = server
+        self.token = token
+        self.tried = tried
+        self.key = key
+        self.upstream_args = upstream_args
+        self.lock = threading.Lock()
+        self.primary = UpstreamAttempt(on_connect=self.start_timer)
+        self.timer = None
+        self.primary_done = False
+        self.hedge_server = None
+        self.hedge_done = threading.Event()
+        self.hedge_result = None
+        self.winner = None
+
+    def run(self):
+        try:
+            resp, response_time = send_upstream(self.server, self.token, *self.upstream_args, attempt=self.primary)
+            error = None
+        except Exception as e:
+            resp, response_time, error = None, None, e
+        with self.lock:
+            self.primary_done = True
+            if self.timer is not None:
+                hedge_timer.cancel(self.timer)
+            if self.winner is None and error is None:
+                self.winner = self.server
+                return self.server, self.token, resp, response_time
+            wait_for_hedge = self.hedge_server is not None
+        if resp is not None:
+            discard_response(self.server, resp)
+        if wait_for_hedge:
+            self.hedge_done.wait()
+            if self.hedge_result is not None:
+                return self.hedge_result
+        raise error
+
+    def start_timer(self):
+        self.timer = hedge_timer.schedule(hedge_delay(self.server, self.upstream_args[0]), self.launch)
+
+    def launch(self):
+        """Hilo de hedge_timer: el principal sigue sin responder, se envía también a otro backend"""
+        with self.lock:
+            if self.primary_done:
+                return
+        try:
+            hedge_server, hedge_token = select_server(self.tried, self.key)
+        except BackendsSaturated:
+            return
+        if hedge_server is None:
+            return
+        if not retry_budget.withdraw():
+            breakers.get(hedge_server).cancel(hedge_token)
+            return
+        with self.lock:
+            if self.primary_done:
+                breakers.get(hedge_server).cancel(hedge_token)
+                return
+            self.hedge_server = hedge_server
+            self.tried.add(hedge_server)
+        with hedge_stats_lock:
+            hedge_stats["sent"] += 1
+        logger.info(f"🔀 Hedge: {self.server} tarda, se envía también a {hedge_server}")
+        hedge_executor.submit(self.run_hedge, hedge_token)
+
+    def run_hedge(self, hedge_token):
+        try:
+            resp, response_time = send_upstream(self.hedge_server, hedge_token, *self.upstream_args)
+        except Exception:
+            self.hedge_done.set()
+            return
+        with self.lock:
+            won = self.winner is None
+            if won:
+                self.winner = self.hedge_server
+                self.hedge_result = (self.hedge_server, hedge_token, resp, response_time)
+                if not self.primary_done:
+                    self.primary.abort()
+        if won:
+            with hedge_stats_lock:
+                hedge_stats["won"] += 1
+        else:
+            discard_response(self.hedge_server, resp)
+        self.hedge_done.set()
+
+def send_hedged(server, token, tried, key, upstream_args):
+    """Envía a `server` y, si tarda más que hedge_delay, también a otro backend; gana el primero.
+    Devuelve (servidor, token, respuesta, tiempo) del ganador"""
+    return HedgedRequest(server, token, tried, key, upstream_args).run()
+
+@app.after_request
+def compress_response(response):
+    """Comprime la respuesta si el cliente lo acepta y merece la pena"""
+    if not COMPRESSION_ENABLED or request.method == 'HEAD' or response.status_code < 200 \
+            or response.status_code in (204, 206, 304) or 'Content-Encoding' in response.headers:
+        return response
+    if response.mimetype not in COMPRESSIBLE_TYPES:
+        compression_stats.skip("type")
+        return response
+    length = response.content_length
+    if length is not None and length < COMPRESSION_MIN_SIZE:
+        compression_stats.skip("too_small")
+        return response
+    available = ('gzip', 'br') if brotli is not None else ('gzip',)
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding', ''), available)
+    response.vary.add('Accept-Encoding')
+    if encoding == 'identity':
+        compression_stats.skip("not_accepted")
+        return response
+
+    response.response = CompressingStream(response.response, encoding)
+    response.headers['Content-Encoding'] = encoding
+    response.headers.pop('Content-Length', None)
+    # El cuerpo ya no es byte a byte el del ETag original
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        response.headers['ETag'] = 'W/' + etag
+    return response
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
@@ -133,126 +2550,563 @@ def proxy(path):
     elif path == 'lb-health':
         return health_status()
     
-    active_servers = get_active_servers()
-    last_error = None
-
-    for server in active_servers:
-        url = f"{server}/{path}"
-        method = request.method
-        headers = {k: v for k, v in request.headers if k != 'Host'}
-        data = request.get_data()
-
-        try:
-            start_time = time.time()
-            resp = requests.request(
-                method=method,
-                url=url,
-                headers=headers,
-                data=data,
-                cookies=request.cookies,
-                params=request.args,
-                allow_redirects=False,
-                stream=True,
-                timeout=5
-            )
-            
-            response_time = time.time() - start_time
-            state.add_request(server, True, response_time, f"/{path}")
-            
-            logger.info(f"✅ Solicitud exitosa a: {url} ({response_time:.3f}s)")
-
-            if server in state.failed_servers:
-                del state.failed_servers[server]
-                state.server_stats[server]['uptime_start'] = datetime.now()
-                logger.info(f"⚡ Servidor {server} recuperado")
+    method = request.method
+    headers = {k: v for k, v in request.headers if k.lower() not in ('host', 'content-length', 'transfer-encoding')}
+    body = None
+    if request.content_length or request.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+        body = RequestBody(request.stream, request.content_length)
+
+    # Caché: GET de rutas cacheables, y las escrituras invalidan su grupo antes y después
+    cache_key = cache_group = stale_entry = None
+    authenticated = any(name in request.headers for name in CACHE_KEY_HEADERS)
+    client_cache_control = parse_cache_control(request.headers.get('Cache-Control', ''))
+    if CACHE_ENABLED and method == 'GET' and 'no-store' not in client_cache_control:
+        cache_group = route_group(CACHE_ROUTES, request.path)
+    if cache_group:
+        cache_key = cache_key_for_request()
+        cache_generation = response_cache.generation(cache_group)
+        if 'no-cache' not in client_cache_control:
+            entry, fresh = response_cache.lookup(cache_key, request.headers)
+            if fresh:
+                return cached_response(entry)
+            if entry is not None and entry.upstream_etag and 'If-None-Match' not in request.headers:
+                stale_entry = entry
+                headers['If-None-Match'] = entry.upstream_etag
+    invalidate_group = None
+    if method in ('POST', 'PUT', 'DELETE'):
+        invalidate_group = route_group(CACHE_INVALIDATIONS, request.path, prefix=True)
+        if invalidate_group:
+            response_cache.invalidate(invalidate_group)
+
+    # Si ya hay un GET idéntico en curso, se espera su respuesta en vez de ir al backend
+    flight = None
+    if COALESCE_ENABLED and method == 'GET' and body is None:
+        flight_key = coalesce_key()
+        call, leader = single_flight.join(flight_key)
+        if leader:
+            flight = FlightFill(flight_key, call)
+        else:
+            result = single_flight.wait(call)
+            if result is not None:
+                return coalesced_response(result)
+
+    if not admission.acquire():
+        if flight is not None:
+            flight.abort()
+        logger.warning(f"🚦 Petición rechazada por saturación: {method} /{path}")
+        return overloaded_response()
+    ticket = AdmissionTicket()
+    deadline = time.monotonic() + ADMISSION_QUEUE_TIMEOUT
 
+    try:
+        upstream_args = (path, method, headers, request.cookies, request.args)
+        hedge = HEDGE_ENABLED and method in ('GET', 'HEAD') and body is None
+
+        retry_budget.deposit()
+        key = routing_key() if balancer.uses_key else None
+        tried = set()
+        last_error = None
+        while True:
+            try:
+                server, token = select_server(tried, key)
+            except BackendsSaturated:
+                ready = lambda: any(s not in tried and can_take_request(s) for s in registry.snapshot.routable)
+                if admission.wait_for_backend(deadline, ready):
+                    continue
+                logger.warning(f"🚦 Todos los backends en su límite de concurrencia: {method} /{path}")
+                return overloaded_response()
+            if server is None:
+                break
+            if tried and not retry_budget.withdraw():
+                breakers.get(server).cancel(token)
+                logger.warning(f"⚠️ Presupuesto de reintentos agotado: no se reintenta {method} /{path} "
+                               f"en {server}. Último error: {str(last_error)}")
+                return retry_budget_response()
+            tried.add(server)
+            try:
+                data = body.reader() if body else None
+            except BodyNotReplayable as e:
+                breakers.get(server).cancel(token)
+                logger.error(f"❌ No se puede reintentar {method} /{path} en {server}: {str(e)}")
+                return "🚫 La petición falló y su cuerpo es demasiado grande para reintentarla.", 502
+
+            try:
+                if hedge:
+                    server, token, resp, response_time = send_hedged(server, token, tried, key, upstream_args)
+                else:
+                    resp, response_time = send_upstream(server, token, *upstream_args, data=data, body=body)
+            except ClientBodyError as e:
+                logger.warning(f"⚠️ El cliente cortó el envío del cuerpo hacia {server}/{path}: {str(e)}")
+                return "Cuerpo de la petición incompleto", 400
+            except Exception as e:
+                last_error = e
+                continue
+
+            if invalidate_group:
+                response_cache.invalidate(invalidate_group)
+            if stale_entry is not None and resp.status_code == 304:
+                resp.close()
+                balancer.release(server)
+                ttl = cache_ttl(resp, revalidated=True, authenticated=authenticated)
+                if ttl is None:
+                    response_cache.invalidate(cache_group)
+                else:
+                    response_cache.refresh(stale_entry, ttl)
+                return cached_response(stale_entry)
+
+            capture = None
+            if cache_group:
+                ttl = cache_ttl(resp, authenticated=authenticated)
+                if ttl is not None:
+                    capture = CacheFill(cache_key, cache_generation, cache_group, resp, request.headers, ttl)
+
+            def finish(server=server):
+                balancer.release(server)
+                ticket.release()
+
+            def stream_failed(server=server, token=token, started=time.time() - response_time):
+                # Las cabeceras ya contaron como éxito: el corte del cuerpo se registra como un fallo más
+                state.add_request(server, False, time.time() - started, f"/{path}")
+                breakers.get(server).record(False, token)
+                expedite_probe(server)
+
+            url = f"{server}/{path}"
+            ticket.streaming = True
             response = Response(
-                resp.content,
+                UpstreamStream(resp, url, on_close=finish, captures=(capture, flight), on_error=stream_failed),
                 resp.status_code,
-                [
-                    (k, v) for k, v in resp.headers.items()
-                    if k.lower() not in ('transfer-encoding', 'content-encoding', 'content-length')
-                ]
+                upstream_headers(resp)
             )
 
+            if cache_group:
+                response.headers['X-Cache'] = "MISS"
             response.headers['X-Upstream-Server'] = server
             response.headers['X-Response-Time'] = f"{response_time:.3f}s"
             response.headers['X-Load-Balancer'] = "TaskFlow-LB/2.0"
+            if flight is not None:
+                flight.attach(response.status_code,
+                              [(k, v) for k, v in response.headers if k.lower() != 'content-length'])
 
             return response
 
-        except Exception as e:
-            response_time = time.time() - start_time
-            state.add_request(server, False, response_time, f"/{path}")
-            last_error = e
-            logger.error(f"❌ Error al conectar con {server}: {str(e)}")
-            state.failed_servers[server] = time.time()
-
-    error_response = "🚫 Servicio temporalmente no disponible. Todos los servidores están caídos."
-    logger.critical(f"TODOS LOS SERVIDORES FALLARON. Último error: {str(last_error)}")
-    return error_response, 503
+        error_response = "🚫 Servicio temporalmente no disponible. Todos los servidores están caídos."
+        logger.critical(f"TODOS LOS SERVIDORES FALLARON. Último error: {str(last_error)}")
+        return error_response, 503
+    finally:
+        if flight is not None and not flight.attached:
+            flight.abort()
+        if not ticket.streaming:
+            ticket.release()
+
+def probe_status(server):
+    """Resumen de los health checks de un backend para /lb-api/stats"""
+    schedule = probe_schedules.get(server)
+    with state._probe_lock:
+        stats = dict(state.probe_stats.get(server, {'probes': 0, 'failures': 0, 'last_probe_time': 0.0}))
+    stats['last_probe_time'] = round(stats['last_probe_time'] * 1000, 2)
+    if schedule is not None:
+        stats['interval_seconds'] = round(schedule.interval, 1)
+        stats['flapping'] = schedule.flapping
+    if server in state.probe_latency:
+        stats['latency'] = state.probe_latency[server].summary()
+    return stats
 
 @app.route('/lb-api/stats')
 def api_stats():
     """API endpoint para obtener estadísticas en JSON"""
-    uptime = datetime.now() - state.start_time
+    now = datetime.now()
+    uptime = now - state.start_time
+    pool_totals, pool_stats = pools.stats()
+    strategy_stats = balancer.stats()
+    all_stats = state.server_stats()
+    empty_stats = {'total_requests': 0, 'successful_requests': 0, 'failed_requests': 0,
+                   'avg_response_time': 0, 'last_response_time': 0}
     
+    snapshot = registry.snapshot
     server_status = {}
-    for server in SERVERS:
-        stats = state.server_stats[server]
-        is_active = server not in state.failed_servers
+    for server in snapshot.servers:
+        stats = all_stats.get(server, empty_stats)
+        failed_at = state.failed_servers.get(server)
+        is_active = failed_at is None
         
-        server_uptime = datetime.now() - stats['uptime_start'] if is_active else timedelta(0)
+        server_uptime = now - state.uptime_start[server] if is_active else timedelta(0)
         
+        circuit = breakers.get(server).stats()
         server_status[server] = {
-            "status": "UP" if is_active else "DOWN",
+            "status": {"closed": "UP", "half_open": "HALF_OPEN"}.get(circuit["state"], "DOWN"),
+            "circuit": circuit,
             "total_requests": stats['total_requests'],
             "successful_requests": stats['successful_requests'],
             "failed_requests": stats['failed_requests'],
             "success_rate": (stats['successful_requests'] / max(stats['total_requests'], 1)) * 100,
+            "responses_by_class": dict(zip(STATUS_CLASSES, stats.get('status_classes', [0] * len(STATUS_CLASSES)))),
             "avg_response_time": round(stats['avg_response_time'] * 1000, 2),
             "last_response_time": round(stats['last_response_time'] * 1000, 2),
-            "uptime_seconds": int(server_uptime.total_seconds())
+            "uptime_seconds": int(server_uptime.total_seconds()),
+            "latency": state.server_latency[server].summary() if server in state.server_latency else {},
+            "connection_pool": pool_stats.get(server, {}),
+            "health_probe": probe_status(server),
+            "weight": snapshot.weights[server],
+            "concurrency_limit": admission.backend_limit(server),
+            "draining": snapshot.backends[server].draining,
+            **strategy_stats.get(server, {})
         }
         
         if not is_active:
-            downtime = time.time() - state.failed_servers[server]
+            downtime = time.time() - failed_at
             server_status[server]["downtime_seconds"] = int(downtime)
-            server_status[server]["retry_in"] = max(0, int(RETRY_INTERVAL - downtime))
+            server_status[server]["retry_in"] = int(circuit.get("retry_in", 0))
 
     return {
         "balancer_uptime": str(uptime),
-        "total_requests": state.total_requests,
-        "active_servers": len([s for s in SERVERS if s not in state.failed_servers]),
-        "total_servers": len(SERVERS),
+        "total_requests": sum(stats['total_requests'] for stats in all_stats.values()),
+        "active_servers": len([s for s in snapshot.routable if s not in state.failed_servers]),
+        "total_servers": len(snapshot.servers),
+        "registry_version": snapshot.version,
+        "strategy": balancer.name,
+        "strategy_details": balancer.details(),
+        "circuit_events": list(circuit_events)[-10:],
+        "retry_budget": retry_budget.stats(),
+        "admission": admission.stats(),
+        "compression": compression_stats.stats(),
+        "logging": {"queue_depth": log_queue.qsize(), "sample_rate": LOG_SUCCESS_SAMPLE_RATE, **log_stats},
+        "hedging": {"enabled": HEDGE_ENABLED, "percentile": HEDGE_PERCENTILE, **hedge_stats},
+        "cache": response_cache.stats(),
+        "coalescing": single_flight.stats(),
         "servers": server_status,
-        "recent_requests": [
-            {
-                "timestamp": req["timestamp"].strftime("%H:%M:%S"),
-                "server": req["server"].split(":")[-1],
-                "success": req["success"],
-                "response_time": round(req["response_time"] * 1000, 1),
-                "path": req["path"]
-            }
-            for req in list(state.request_history)[-10:]
-        ]
+        "connection_pool": pool_totals,
+        "routes": {route: histogram.summary() for route, histogram in list(state.route_latency.items())},
+        "recent_requests": [format_request(entry) for entry in state.recent_requests(10)]
+    }
+
+def format_request(entry):
+    _, timestamp, server, success, response_time, path = entry
+    return {
+        "timestamp": time.strftime("%H:%M:%S", time.localtime(timestamp)),
+        "server": server.split(":")[-1],
+        "success": success,
+        "response_time": round(response_time * 1000, 1),
+        "path": path
     }
 
+@app.route('/lb-api/series')
+def api_series():
+    """Series de tráfico para las gráficas: ?tier=second|minute|hour&points=N"""
+    tier = request.args.get('tier', 'second')
+    if tier not in [name for name, _, _ in SERIES_TIERS]:
+        return {"error": f"tier desconocido: {tier}"}, 400
+    points = request.args.get('points', type=int)
+    return state.series.query(tier, points)
+
+def prometheus_labels(**labels):
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+@app.route('/lb-metrics')
+def prometheus_metrics():
+    """Métricas en formato de texto de Prometheus, leídas de los contadores ya agregados"""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP taskflow_lb_{name} {help_text}")
+        lines.append(f"# TYPE taskflow_lb_{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"taskflow_lb_{name}{labels} {value}")
+
+    all_stats = state.server_stats()
+    _, pool_stats = pools.stats()
+    servers = registry.snapshot.servers
+
+    metric("uptime_seconds", "gauge", "Segundos desde que arrancó el balanceador",
+           [("", round((datetime.now() - state.start_time).total_seconds(), 3))])
+    metric("backend_up", "gauge", "1 si el circuito del backend está cerrado",
+           [(prometheus_labels(backend=server), int(breakers.get(server).state == CircuitBreaker.CLOSED))
+            for server in servers])
+    metric("requests_total", "counter", "Peticiones reenviadas por backend y clase de estado",
+           [(prometheus_labels(backend=server, code=code), all_stats[server]['status_classes'][index])
+            for server in servers if server in all_stats
+            for index, code in enumerate(STATUS_CLASSES)])
+    metric("outstanding_requests", "gauge", "Peticiones en curso por backend",
+           [(prometheus_labels(backend=server), balancer.outstanding.get(server, 0)) for server in servers])
+    metric("pool_connections", "gauge", "Conexiones keep-alive por backend y estado",
+           [(prometheus_labels(backend=server, state=kind), pool_stats[server][kind])
+            for server in servers if server in pool_stats
+            for kind in ('checked_out', 'idle')])
+    metric("concurrency_limit", "gauge", "Límite de peticiones en curso por backend",
+           [(prometheus_labels(backend=server), admission.backend_limit(server)) for server in servers])
+    admission_stats = admission.stats()
+    metric("admission_in_flight", "gauge", "Peticiones admitidas en curso", [("", admission_stats["in_flight"])])
+    metric("admission_rejected_total", "counter", "Peticiones rechazadas con 503 por saturación",
+           [(prometheus_labels(reason=reason), admission_stats[f"rejected_{reason}"])
+            for reason in ("queue_full", "timeout", "saturated")])
+    metric("circuit_trips_total", "counter", "Veces que se abrió el circuito del backend",
+           [(prometheus_labels(backend=server), breakers.get(server).trips) for server in servers])
+
+    samples = []
+    for server in servers:
+        histogram = state.server_latency.get(server)
+        if histogram is None:
+            continue
+        counts, total = histogram.totals()
+        for bound, count in zip(PROMETHEUS_BUCKETS + ('+Inf',), counts):
+            samples.append(("_bucket" + prometheus_labels(backend=server, le=bound), count))
+        samples.append(("_sum" + prometheus_labels(backend=server), round(total, 6)))
+        samples.append(("_count" + prometheus_labels(backend=server), counts[-1]))
+    metric("request_duration_seconds", "histogram", "Latencia de las peticiones a cada backend", samples)
+
+    cache = response_cache.stats()
+    metric("cache_requests_total", "counter", "Consultas a la caché de respuestas por resultado",
+           [(prometheus_labels(result="hit"), cache["hits"]), (prometheus_labels(result="miss"), cache["misses"])])
+    metric("cache_bytes", "gauge", "Bytes ocupados por la caché de respuestas", [("", cache["bytes"])])
+    metric("coalesced_requests_total", "counter", "Peticiones respondidas con la respuesta de un GET idéntico",
+           [("", single_flight.coalesced)])
+    metric("hedged_requests_total", "counter", "Peticiones duplicadas enviadas a otro backend",
+           [(prometheus_labels(result="sent"), hedge_stats["sent"]), (prometheus_labels(result="won"), hedge_stats["won"])])
+    metric("log_events_discarded_total", "counter", "Eventos de log no escritos por cola llena o muestreo",
+           [(prometheus_labels(reason="dropped"), log_stats["dropped"]),
+            (prometheus_labels(reason="sampled_out"), log_stats["sampled_out"])])
+    metric("retry_budget_tokens", "gauge", "Reintentos disponibles en el presupuesto",
+           [("", round(retry_budget.stats()["tokens"], 2))])
+
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+def dict_delta(old, new):
+    """Claves de `new` que cambiaron respecto a `old` (recursivo en dicts; None = clave borrada)"""
+    delta = {}
+    for key, value in new.items():
+        previous = old.get(key)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            nested = dict_delta(previous, value)
+            if nested:
+                delta[key] = nested
+        elif value != previous or key not in old:
+            delta[key] = value
+    for key in old:
+        if key not in new:
+            delta[key] = None
+    return delta
+
+class SSESubscriber:
+    __slots__ = ('queue', 'dropped')
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+        self.dropped = False
+
+class DashboardBroadcaster:
+    """Calcula el estado del dashboard una vez por tick y reparte solo los cambios a todos los clientes SSE"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.snapshot = None
+        self.last_request_seq = 0
+        self.last_series_timestamp = 0
+        self.thread = None
+        self.ticks = 0
+        self.dropped = 0
+
+    @staticmethod
+    def _message(event, payload):
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+    def _collect(self):
+        stats = api_stats()
+        stats.pop("recent_requests")
+        return stats
+
+    def _latest_series(self):
+        """Último segundo completo de la serie de tráfico"""
+        series = state.series.query('second', 1, time.time() - 1)
+        return {
+            "timestamp": series["timestamps"][0],
+            "servers": {server: {"rps": values["rps"][0], "error_rate": values["error_rate"][0]}
+                        for server, values in series["servers"].items()}
+        }
+
+    def subscribe(self):
+        subscriber = SSESubscriber()
+        with self.lock:
+            if self.snapshot is None:
+                requests_log = state.recent_requests(10)
+                self.snapshot = {"stats": self._collect(),
+                                 "requests": [format_request(entry) for entry in requests_log]}
+                self.last_request_seq = requests_log[-1][0] if requests_log else 0
+            subscriber.queue.put_nowait(self._message("snapshot", self.snapshot))
+            self.subscribers.add(subscriber)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="sse-broadcaster", daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def _run(self):
+        while True:
+            time.sleep(SSE_INTERVAL)
+            with self.lock:
+                if not self.subscribers:
+                    # Sin clientes no se calcula nada; el próximo subscribe parte de un estado nuevo
+                    self.thread = None
+                    self.snapshot = None
+                    return
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"❌ Error calculando los cambios del dashboard: {str(e)}")
+
+    def tick(self):
+        stats = self._collect()
+        series = self._latest_series()
+
+        # El snapshot y el envío van bajo el mismo lock: quien se suscribe recibe el estado
+        # completo antes o después de este delta, nunca ambos
+        with self.lock:
+            new_requests = state.recent_requests(MAX_REQUEST_HISTORY, after=self.last_request_seq)
+            delta = {}
+            changes = dict_delta(self.snapshot["stats"], stats)
+            if changes:
+                delta["stats"] = changes
+            if new_requests:
+                self.last_request_seq = new_requests[-1][0]
+                delta["requests"] = [format_request(entry) for entry in new_requests[-10:]]
+                self.snapshot["requests"] = (self.snapshot["requests"] + delta["requests"])[-10:]
+            if series["timestamp"] > self.last_series_timestamp:
+                self.last_series_timestamp = series["timestamp"]
+                delta["series"] = series
+            self.snapshot["stats"] = stats
+            self.ticks += 1
+            if not delta:
+                return
+
+            message = self._message("delta", delta)
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.queue.put_nowait(message)
+                except queue.Full:
+                    # Un cliente que no lee no frena a los demás: se corta y al reconectar recibe el estado completo
+                    subscriber.dropped = True
+                    self.subscribers.discard(subscriber)
+                    self.dropped += 1
+
+broadcaster = DashboardBroadcaster()
+
+@app.route('/lb-api/events')
+def dashboard_events():
+    """Stream SSE con los cambios del dashboard"""
+    subscriber = broadcaster.subscribe()
+
+    def stream():
+        try:
+            yield f"retry: {SSE_INTERVAL * 3000}\n\n"
+            while not subscriber.dropped:
+                try:
+                    yield subscriber.queue.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def admin_allowed():
+    if ADMIN_TOKEN:
+        return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+def backends_status():
+    snapshot = registry.snapshot
+    backends = []
+    for url, backend in snapshot.backends.items():
+        in_flight = balancer.outstanding.get(url, 0)
+        backends.append({
+            **backend.to_dict(),
+            "in_flight": in_flight,
+            "circuit": breakers.get(url).state,
+            # Drenado del todo: ya se puede eliminar sin cortar peticiones
+            "drained": backend.draining and in_flight == 0
+        })
+    return {"version": snapshot.version, "backends": backends}
+
+@app.route('/lb-admin/backends', methods=['GET', 'POST', 'PUT', 'DELETE'])
+def admin_backends():
+    """Administración de backends en caliente: listar, añadir, cambiar peso o drenaje y eliminar"""
+    if not admin_allowed():
+        return {"error": "no autorizado"}, 403
+    if request.method == 'GET':
+        return backends_status()
+
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    elif not isinstance(data, dict):
+        return {"error": "el cuerpo debe ser un objeto JSON"}, 400
+    url = str(data.get('url') or request.args.get('url', '')).rstrip('/')
+    try:
+        if request.method == 'POST':
+            backend = parse_backend(data)
+            registry.add(backend)
+            logger.info(f"➕ Backend añadido: {backend.url} (peso {backend.weight})")
+        elif request.method == 'PUT':
+            weight = data.get('weight')
+            if weight is not None and (not isinstance(weight, int) or isinstance(weight, bool) or weight < 1):
+                raise ValueError(f"peso no válido: {weight!r}")
+            draining = data.get('draining')
+            registry.update(url, weight, None if draining is None else bool(draining))
+            logger.info(f"✏️ Backend actualizado: {url} {registry.snapshot.backends[url].to_dict()}")
+        else:
+            registry.remove(url)
+            logger.info(f"➖ Backend eliminado: {url}")
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except KeyError:
+        if request.method == 'POST':
+            return {"error": f"el backend ya existe: {url}"}, 409
+        return {"error": f"backend desconocido: {url}"}, 404
+
+    return backends_status(), 201 if request.method == 'POST' else 200
+
+def reload_backends_file(last_signature):
+    """Aplica BACKENDS_FILE si cambió desde `last_signature`; devuelve la firma (mtime, tamaño) actual"""
+    try:
+        stat = os.stat(BACKENDS_FILE)
+    except FileNotFoundError:
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if signature == last_signature:
+        return signature
+    try:
+        with open(BACKENDS_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        entries = [parse_backend(entry) for entry in data.get('servers', [])]
+        if not entries:
+            raise ValueError("no hay ningún backend")
+        if registry.replace(entries):
+            logger.info(f"📄 Backends recargados desde {BACKENDS_FILE}")
+    except (OSError, ValueError, AttributeError) as e:
+        logger.error(f"❌ No se pudo cargar {BACKENDS_FILE}: {str(e)}")
+    return signature
+
+def backends_watch_loop(signature):
+    """Vigila BACKENDS_FILE y aplica sus cambios sin reiniciar"""
+    while True:
+        time.sleep(BACKENDS_WATCH_INTERVAL)
+        signature = reload_backends_file(signature)
+
 @app.route('/lb-health')
 def health_status():
     """Endpoint de salud para el load balancer"""
-    active_count = len([s for s in SERVERS if s not in state.failed_servers])
+    snapshot = registry.snapshot
+    active_count = len([s for s in snapshot.routable if s not in state.failed_servers])
     
     if active_count > 0:
-        return {"status": "healthy", "active_servers": active_count, "total_servers": len(SERVERS)}, 200
+        return {"status": "healthy", "active_servers": active_count, "total_servers": len(snapshot.servers)}, 200
     else:
-        return {"status": "unhealthy", "active_servers": 0, "total_servers": len(SERVERS)}, 503
+        return {"status": "unhealthy", "active_servers": 0, "total_servers": len(snapshot.servers)}, 503
 
-@app.route('/lb-status')
-def dashboard():
-    """Dashboard web unificado del balanceador"""
-    
-    dashboard_html = '''
+DASHBOARD_HTML = '''
 <!DOCTYPE html>
 <html lang="es">
 <head>
@@ -471,6 +3325,10 @@ def dashboard():
             border-left-color: #f44336;
         }
 
+        .server-half {
+            border-left-color: #ff9800;
+        }
+
         .server-header {
             display: flex;
             justify-content: space-between;
@@ -507,6 +3365,12 @@ def dashboard():
             border: 1px solid rgba(244, 67, 54, 0.2);
         }
 
+        .status-half {
+            background: rgba(255, 152, 0, 0.1);
+            color: #e65100;
+            border: 1px solid rgba(255, 152, 0, 0.2);
+        }
+
         .pulse {
             width: 8px;
             height: 8px;
@@ -522,6 +3386,10 @@ def dashboard():
             background: #f44336;
         }
 
+        .pulse-orange {
+            background: #ff9800;
+        }
+
         @keyframes pulse {
             0%, 100% { opacity: 1; transform: scale(1); }
             50% { opacity: 0.5; transform: scale(1.1); }
@@ -579,6 +3447,37 @@ def dashboard():
             color: #f44336;
         }
 
+        .charts {
+            display: grid;
+            grid-template-columns: repeat(auto-fit, minmax(320px, 1fr));
+            gap: var(--space-lg);
+        }
+
+        .chart {
+            background: var(--gray-50);
+            border-radius: var(--radius-lg);
+            padding: var(--space-lg);
+        }
+
+        .chart-title {
+            font-size: 0.9rem;
+            color: var(--gray-600);
+            margin-bottom: var(--space-sm);
+        }
+
+        .chart canvas {
+            width: 100%;
+            height: 180px;
+        }
+
+        .chart-legend {
+            display: flex;
+            gap: var(--space-md);
+            font-size: 0.8rem;
+            color: var(--gray-600);
+            margin-top: var(--space-sm);
+        }
+
         .auto-refresh {
             position: fixed;
             bottom: var(--space-lg);
@@ -621,6 +3520,29 @@ def dashboard():
             </div>
         </div>
 
+        <div class="section">
+            <h2 class="section-title">Tráfico (últimos 5 minutos)</h2>
+            <div class="charts">
+                <div class="chart">
+                    <div class="chart-title">Requests por segundo</div>
+                    <canvas id="throughputChart"></canvas>
+                    <div class="chart-legend" id="throughputLegend"></div>
+                </div>
+                <div class="chart">
+                    <div class="chart-title">Tasa de error (%)</div>
+                    <canvas id="errorChart"></canvas>
+                    <div class="chart-legend" id="errorLegend"></div>
+                </div>
+            </div>
+        </div>
+
+        <div class="section">
+            <h2 class="section-title">Eventos del Circuito</h2>
+            <div class="request-log" id="circuitLog">
+                <!-- Los cambios de estado de los circuit breakers se cargarán aquí -->
+            </div>
+        </div>
+
         <div class="section">
             <h2 class="section-title">Requests Recientes</h2>
             <div class="request-log" id="requestLog">
@@ -630,7 +3552,7 @@ def dashboard():
     </div>
 
     <div class="auto-refresh">
-        🔄 Actualización automática cada 2s
+        🔄 Actualización en vivo
     </div>
 
     <script>
@@ -641,6 +3563,7 @@ def dashboard():
                 
                 updateStatsGrid(data);
                 updateServers(data);
+                updateCircuitLog(data);
                 updateRequestLog(data);
                 
             } catch (error) {
@@ -674,17 +3597,25 @@ def dashboard():
             const container = document.getElementById('serversContainer');
             container.innerHTML = '';
             
+            const looks = {
+                UP: { card: 'server-up', indicator: 'status-up', pulse: 'pulse-green', label: 'ACTIVO' },
+                HALF_OPEN: { card: 'server-half', indicator: 'status-half', pulse: 'pulse-orange', label: 'EN PRUEBA' },
+                DOWN: { card: 'server-down', indicator: 'status-down', pulse: 'pulse-red', label: 'CAÍDO' }
+            };
+            const circuitNames = { closed: 'Cerrado', half_open: 'Semiabierto', open: 'Abierto' };
+
             Object.entries(data.servers).forEach(([server, stats]) => {
                 const isUp = stats.status === 'UP';
+                const look = looks[stats.status] || looks.DOWN;
                 const serverCard = document.createElement('div');
-                serverCard.className = `server-card ${isUp ? 'server-up' : 'server-down'}`;
+                serverCard.className = `server-card ${look.card}`;
                 
                 serverCard.innerHTML = `
                     <div class="server-header">
                         <div class="server-name">${server}</div>
-                        <div class="status-indicator ${isUp ? 'status-up' : 'status-down'}">
-                            <div class="pulse ${isUp ? 'pulse-green' : 'pulse-red'}"></div>
-                            ${isUp ? 'ACTIVO' : 'CAÍDO'}
+                        <div class="status-indicator ${look.indicator}">
+                            <div class="pulse ${look.pulse}"></div>
+                            ${look.label}${stats.draining ? ' · DRENANDO' : ''}
                         </div>
                     </div>
                     <div class="server-metrics">
@@ -704,6 +3635,10 @@ def dashboard():
                             <div class="metric-value">${isUp ? Math.floor(stats.uptime_seconds / 60) : Math.floor((stats.downtime_seconds || 0) / 60)}m</div>
                             <div class="metric-label">${isUp ? 'Uptime' : 'Downtime'}</div>
                         </div>
+                        <div class="metric">
+                            <div class="metric-value">${circuitNames[stats.circuit.state]}</div>
+                            <div class="metric-label">Circuito (${stats.circuit.trips} aperturas)</div>
+                        </div>
                     </div>
                 `;
                 
@@ -711,6 +3646,22 @@ def dashboard():
             });
         }
 
+        function updateCircuitLog(data) {
+            const log = document.getElementById('circuitLog');
+            log.innerHTML = '';
+
+            data.circuit_events.slice().reverse().forEach(event => {
+                const item = document.createElement('div');
+                item.className = 'request-item';
+                item.innerHTML = `
+                    <span>${event.timestamp}</span>
+                    <span>${event.server}</span>
+                    <span>${event.from} → ${event.to}</span>
+                `;
+                log.appendChild(item);
+            });
+        }
+
         function updateRequestLog(data) {
             const log = document.getElementById('requestLog');
             log.innerHTML = '';
@@ -730,33 +3681,209 @@ def dashboard():
             });
         }
 
-        loadStats();
-        setInterval(loadStats, 2000);
+        const chartColors = ['#667eea', '#ff6b6b', '#4CAF50', '#ff9800', '#764ba2', '#00bcd4'];
+
+        let current = null;
+        let recentRequests = [];
+        let seriesData = null;
+
+        async function loadSeries() {
+            try {
+                const response = await fetch('/lb-api/series?tier=second&points=300');
+                seriesData = await response.json();
+                drawCharts();
+
+            } catch (error) {
+                console.error('Error loading series:', error);
+            }
+        }
+
+        function drawCharts() {
+            drawChart('throughputChart', 'throughputLegend', seriesData, 'rps');
+            drawChart('errorChart', 'errorLegend', seriesData, 'error_rate');
+        }
+
+        function appendSeries(point) {
+            const timestamps = seriesData && seriesData.timestamps;
+            if (!timestamps || point.timestamp <= timestamps[timestamps.length - 1]) return;
+
+            timestamps.push(point.timestamp);
+            timestamps.shift();
+            Object.keys(point.servers).forEach(server => {
+                if (!seriesData.servers[server]) {
+                    seriesData.servers[server] = { rps: timestamps.map(() => 0), error_rate: timestamps.map(() => 0) };
+                }
+            });
+            Object.entries(seriesData.servers).forEach(([server, values]) => {
+                const latest = point.servers[server] || { rps: 0, error_rate: 0 };
+                ['rps', 'error_rate'].forEach(field => {
+                    values[field].push(latest[field]);
+                    values[field].shift();
+                });
+            });
+            drawCharts();
+        }
+
+        // Aplica un delta del servidor: los objetos se mezclan por clave, el resto se reemplaza
+        function applyDelta(target, delta) {
+            Object.entries(delta).forEach(([key, value]) => {
+                const isObject = v => v && typeof v === 'object' && !Array.isArray(v);
+                if (value === null) {
+                    delete target[key];
+                } else if (isObject(value) && isObject(target[key])) {
+                    applyDelta(target[key], value);
+                } else {
+                    target[key] = value;
+                }
+            });
+        }
+
+        function connectEvents() {
+            const source = new EventSource('/lb-api/events');
+
+            source.addEventListener('snapshot', event => {
+                const snapshot = JSON.parse(event.data);
+                current = snapshot.stats;
+                recentRequests = snapshot.requests;
+                updateStatsGrid(current);
+                updateServers(current);
+                updateCircuitLog(current);
+                updateRequestLog({ recent_requests: recentRequests.slice() });
+                loadSeries();
+            });
+
+            source.addEventListener('delta', event => {
+                const delta = JSON.parse(event.data);
+                if (delta.stats && current) {
+                    applyDelta(current, delta.stats);
+                    updateStatsGrid(current);
+                    if (delta.stats.servers) updateServers(current);
+                    if (delta.stats.circuit_events) updateCircuitLog(current);
+                }
+                if (delta.requests) {
+                    recentRequests = recentRequests.concat(delta.requests).slice(-10);
+                    updateRequestLog({ recent_requests: recentRequests.slice() });
+                }
+                if (delta.series) appendSeries(delta.series);
+            });
+        }
+
+        function drawChart(canvasId, legendId, data, field) {
+            const canvas = document.getElementById(canvasId);
+            const ratio = window.devicePixelRatio || 1;
+            canvas.width = canvas.clientWidth * ratio;
+            canvas.height = canvas.clientHeight * ratio;
+            const ctx = canvas.getContext('2d');
+            ctx.scale(ratio, ratio);
+            const width = canvas.clientWidth;
+            const height = canvas.clientHeight;
+
+            const series = Object.entries(data.servers).map(([server, values], i) => ({
+                label: server.split(':').pop(),
+                color: chartColors[i % chartColors.length],
+                values: values[field]
+            }));
+            const max = Math.max(1, ...series.flatMap(s => s.values));
+
+            ctx.strokeStyle = '#e5e7eb';
+            ctx.fillStyle = '#4b5563';
+            ctx.font = '11px sans-serif';
+            ctx.beginPath();
+            ctx.moveTo(0, height - 1);
+            ctx.lineTo(width, height - 1);
+            ctx.stroke();
+            ctx.fillText(max.toFixed(max < 10 ? 1 : 0), 4, 12);
+
+            series.forEach(s => {
+                const step = width / Math.max(s.values.length - 1, 1);
+                ctx.strokeStyle = s.color;
+                ctx.lineWidth = 1.5;
+                ctx.beginPath();
+                s.values.forEach((value, i) => {
+                    const y = height - 2 - (value / max) * (height - 16);
+                    if (i === 0) ctx.moveTo(0, y); else ctx.lineTo(i * step, y);
+                });
+                ctx.stroke();
+            });
+
+            document.getElementById(legendId).innerHTML = series
+                .map(s => `<span style="color: ${s.color}">● Puerto ${s.label}</span>`)
+                .join('');
+        }
+
+        if (window.EventSource) {
+            connectEvents();
+        } else {
+            loadStats();
+            loadSeries();
+            setInterval(loadStats, 2000);
+            setInterval(loadSeries, 2000);
+        }
     </script>
 </body>
 </html>
-    '''
-    
-    return dashboard_html
+'''
+
+class StaticAsset:
+    """Página precalculada al arrancar: cuerpo, variantes comprimidas y ETag fuerte por variante"""
+
+    def __init__(self, content, mimetype):
+        body = content.encode('utf-8')
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.mimetype = mimetype
+        self.variants = {
+            'identity': (body, f'"{digest}"'),
+            'gzip': (gzip.compress(body, 9, mtime=0), f'"{digest}-gzip"')
+        }
+        if brotli is not None:
+            self.variants['br'] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+
+    def serve(self):
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding', ''), self.variants)
+        body, etag = self.variants[encoding]
+        if etag_matches(request.headers.get('If-None-Match', ''), etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype=self.mimetype)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.headers['ETag'] = etag
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+dashboard_asset = StaticAsset(DASHBOARD_HTML, 'text/html')
+
+@app.route('/lb-status')
+def dashboard():
+    """Dashboard web unificado del balanceador"""
+    return dashboard_asset.serve()
 
 def check_servers_on_startup():
     """Verificar que los servidores estén activos al inicio"""
     logger.info("🚀 Verificando servidores al inicio...")
-    for server in SERVERS:
+    for server in registry.snapshot.servers:
         if check_server_health(server):
             logger.info(f"✅ Servidor {server} activo")
         else:
-            state.failed_servers[server] = time.time()
             logger.warning(f"❌ Servidor {server} no responde al inicio")
+            breakers.get(server).trip()
 
 if __name__ == '__main__':
     print("🎯 Iniciando TaskFlow Load Balancer v2.0...")
-    
+
+    backends_signature = reload_backends_file(None)
     check_servers_on_startup()
 
+    watch_thread = threading.Thread(target=backends_watch_loop, args=(backends_signature,), daemon=True)
+    watch_thread.start()
+
     health_thread = threading.Thread(target=health_check_loop, daemon=True)
     health_thread.start()
 
+    eviction_thread = threading.Thread(target=pool_eviction_loop, daemon=True)
+    eviction_thread.start()
+
     logger.info("⚖️ Balanceador de carga iniciado en http://localhost:8080")
     logger.info("📊 Dashboard disponible en http://localhost:8080/lb-status")
     logger.info("🔗 API de estadísticas en http://localhost:8080/lb-api/stats")
@@ -0,0 +1,53 @@
+import threading
+import time
+
+import load_balancer as lb
+from load_balancer import AdmissionController
+
+
+def test_release_hands_slot_to_queued_request(monkeypatch):
+    monkeypatch.setattr(lb, "ADMISSION_MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(lb, "ADMISSION_QUEUE_TIMEOUT", 5)
+    admission = AdmissionController()
+    assert admission.acquire()
+
+    results = []
+    waiters = [threading.Thread(target=lambda: results.append(admission.acquire())) for _ in range(2)]
+    for waiter in waiters:
+        waiter.start()
+    while admission.stats()["waiting"] < 2:
+        time.sleep(0.001)
+
+    # Cada plaza liberada pasa a un único hilo de la cola
+    admission.release()
+    waiters_alive = lambda: sum(waiter.is_alive() for waiter in waiters)
+    deadline = time.monotonic() + 2
+    while waiters_alive() > 1 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert results == [True]
+    assert admission.stats()["in_flight"] == 1
+
+    admission.release()
+    for waiter in waiters:
+        waiter.join(2)
+    assert results == [True, True]
+
+
+def test_release_wakes_backend_waiters():
+    admission = AdmissionController()
+    assert admission.acquire()
+    free = threading.Event()
+
+    waited = []
+    waiter = threading.Thread(
+        target=lambda: waited.append(admission.wait_for_backend(time.monotonic() + 5, free.is_set)))
+    waiter.start()
+    while admission.stats()["waiting_backend"] == 0:
+        time.sleep(0.001)
+
+    free.set()
+    admission.release()
+    waiter.join(2)
+
+    assert waited == [True]
+    assert admission.stats()["queued"] == 1
@@ -0,0 +1,79 @@
+import time
+
+import load_balancer as lb
+from load_balancer import CircuitBreaker
+
+SERVER = "http://breaker-test:1"
+
+
+def open_breaker(breaker):
+    tokens = [breaker.acquire() for _ in range(lb.BREAKER_CONSECUTIVE_FAILURES)]
+    for token in tokens:
+        breaker.record(False, token)
+    assert breaker.state == CircuitBreaker.OPEN
+    return tokens
+
+
+def test_late_success_does_not_close_open_breaker():
+    breaker = CircuitBreaker(SERVER)
+    late = breaker.acquire()
+    open_breaker(breaker)
+
+    # Petición que ya estaba en curso cuando se abrió el circuito
+    breaker.record(True, late)
+
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_late_success_does_not_count_as_trial():
+    breaker = CircuitBreaker(SERVER)
+    late = [breaker.acquire() for _ in range(lb.BREAKER_HALF_OPEN_SUCCESSES)]
+    open_breaker(breaker)
+    breaker.open_until = time.monotonic()
+
+    trial = breaker.acquire()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    for token in late:
+        breaker.record(True, token)
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.trials_in_flight == 1
+    assert breaker.trial_successes == 0
+    breaker.record(True, trial)
+    assert breaker.trial_successes == 1
+
+
+def test_trial_successes_close_breaker():
+    breaker = CircuitBreaker(SERVER)
+    open_breaker(breaker)
+    breaker.open_until = time.monotonic()
+
+    trials = [breaker.acquire() for _ in range(lb.BREAKER_HALF_OPEN_TRIALS)]
+    assert breaker.acquire() is None
+    for token in trials[:lb.BREAKER_HALF_OPEN_SUCCESSES]:
+        breaker.record(True, token)
+
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_forced_attempt_without_token_is_ignored():
+    breaker = CircuitBreaker(SERVER)
+    open_breaker(breaker)
+
+    breaker.record(True, None)
+
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_healthy_probes_close_half_open_breaker_without_traffic():
+    breaker = CircuitBreaker(SERVER)
+    open_breaker(breaker)
+
+    assert SERVER in lb.state.failed_servers
+    breaker.record_probe(True)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    for _ in range(lb.BREAKER_HALF_OPEN_SUCCESSES):
+        breaker.record_probe(True)
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert SERVER not in lb.state.failed_servers
@@ -0,0 +1,71 @@
+import threading
+
+from load_balancer import LoadBalancerState, ShardedHistogram, ThroughputSeries
+
+THREADS = 16
+CALLS = 5000
+SERVER = "http://metrics-test:1"
+
+
+def run_threads(target):
+    threads = [threading.Thread(target=target) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_series_totals_are_exact_under_concurrency():
+    series = ThroughputSeries()
+    now = 1_000_000.5
+
+    def record():
+        for i in range(CALLS):
+            series.record(SERVER, i % 10 != 0, 0.01, now)
+
+    run_threads(record)
+
+    result = series.query('second', 1, now)
+    assert result["servers"][SERVER]["requests"] == [THREADS * CALLS]
+    assert result["servers"][SERVER]["errors"] == [THREADS * CALLS // 10]
+    assert result["total"]["requests"] == [THREADS * CALLS]
+    assert series.query('hour', 1, now)["total"]["requests"] == [THREADS * CALLS]
+
+
+def test_sharded_counters_are_exact_under_concurrency():
+    state = LoadBalancerState()
+
+    def add():
+        for i in range(CALLS):
+            if i % 4 == 0:
+                state.add_request(SERVER, False, 0.02, "/api/tasks")
+            else:
+                state.add_request(SERVER, True, 0.01, "/api/tasks", 200)
+
+    run_threads(add)
+
+    stats = state.server_stats()[SERVER]
+    assert state.total_requests == THREADS * CALLS
+    assert stats['total_requests'] == THREADS * CALLS
+    assert stats['failed_requests'] == THREADS * CALLS // 4
+    assert stats['successful_requests'] == THREADS * CALLS * 3 // 4
+    assert stats['status_classes'][0] == THREADS * CALLS // 4
+    assert stats['status_classes'][2] == THREADS * CALLS * 3 // 4
+
+
+def test_sharded_histogram_merges_all_threads():
+    histogram = ShardedHistogram()
+
+    def record():
+        for i in range(CALLS):
+            histogram.record(0.5 if i % 100 == 0 else 0.01)
+
+    run_threads(record)
+
+    counts, total = histogram.totals()
+    assert counts[-1] == THREADS * CALLS
+    assert abs(total - THREADS * CALLS * (0.99 * 0.01 + 0.01 * 0.5)) < 1e-6
+    summary = histogram.summary()['1m']
+    assert summary['count'] == THREADS * CALLS
+    assert summary['max'] == 500.0
+    assert histogram.quantile(0.5) < 0.02 < histogram.quantile(0.999)
@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+
+from requests.structures import CaseInsensitiveDict
+
+from load_balancer import CACHE_DEFAULT_TTL, cache_ttl
+
+
+def upstream(cache_control=None, status=200):
+    headers = CaseInsensitiveDict()
+    if cache_control is not None:
+        headers['Cache-Control'] = cache_control
+    return SimpleNamespace(status_code=status, headers=headers)
+
+
+def test_default_ttl_only_for_anonymous_requests():
+    assert cache_ttl(upstream()) == CACHE_DEFAULT_TTL
+    assert cache_ttl(upstream(), authenticated=True) is None
+
+
+def test_authenticated_responses_need_public():
+    assert cache_ttl(upstream('max-age=30'), authenticated=True) is None
+    assert cache_ttl(upstream('public'), authenticated=True) is None
+    assert cache_ttl(upstream('public, max-age=30'), authenticated=True) == 30
+
+
+def test_private_is_never_stored():
+    assert cache_ttl(upstream('private, max-age=30')) is None
@@ -0,0 +1,30 @@
+import random
+
+from load_balancer import LeastOutstandingStrategy
+
+SERVERS = [f"http://strategy-test:{port}" for port in range(1, 6)]
+
+
+def test_least_outstanding_tracks_minimum_bucket():
+    strategy = LeastOutstandingStrategy(SERVERS)
+    rng = random.Random(7)
+    for _ in range(2000):
+        server = rng.choice(SERVERS)
+        if rng.random() < 0.55:
+            strategy.acquire(server)
+        else:
+            strategy.release(server)
+        assert strategy.min_count == min(strategy.buckets)
+        least = min(strategy.outstanding.values())
+        assert strategy.outstanding[strategy.select(lambda s: True, set())] == least
+
+
+def test_least_outstanding_skips_unavailable_and_tried():
+    strategy = LeastOutstandingStrategy(SERVERS)
+    for server in SERVERS[1:]:
+        strategy.acquire(server)
+    strategy.acquire(SERVERS[2])
+
+    assert strategy.select(lambda s: True, set()) == SERVERS[0]
+    assert strategy.select(lambda s: True, {SERVERS[0]}) in SERVERS[1:2] + SERVERS[3:]
+    assert strategy.select(lambda s: s == SERVERS[2], set()) == SERVERS[2]
@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+import stat
+
+import pytest
+
+import app
+
+WORKERS = 4
+WRITES_PER_WORKER = 50
+
+
+def use_files(directory):
+    app.TASKS_FILE = os.path.join(directory, 'tasks.json')
+    app.TASKS_JOURNAL_FILE = os.path.join(directory, 'tasks.journal')
+    app.TASKS_DB_FILE = os.path.join(directory, 'tasks.db')
+
+
+@pytest.fixture
+def task_files(tmp_path, monkeypatch):
+    for name in ('TASKS_FILE', 'TASKS_JOURNAL_FILE', 'TASKS_DB_FILE'):
+        monkeypatch.setattr(app, name, getattr(app, name))
+    use_files(str(tmp_path))
+    with open(app.TASKS_FILE, 'w') as file:
+        file.write('[]')
+    return tmp_path
+
+
+def make_store(backend):
+    return app.SQLiteTaskStore() if backend == 'sqlite' else app.TaskStore()
+
+
+def writer(directory, backend, worker):
+    use_files(directory)
+    app.COMPACT_MIN_ENTRIES = 10
+    store = make_store(backend)
+    for i in range(WRITES_PER_WORKER):
+        store.add(f"{worker}-{i}")
+        if backend == 'journal' and i % 10 == 0:
+            store.compact()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="usa procesos con fork")
+@pytest.mark.parametrize('backend', ['journal', 'sqlite'])
+def test_concurrent_writer_processes_lose_no_updates(task_files, backend):
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=writer, args=(str(task_files), backend, worker))
+                 for worker in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+    assert [process.exitcode for process in processes] == [0] * WORKERS
+
+    titles = [task['title'] for task in make_store(backend).all()]
+    expected = [f"{worker}-{i}" for worker in range(WORKERS) for i in range(WRITES_PER_WORKER)]
+    assert sorted(titles) == sorted(expected)
+
+
+def test_atomic_write_keeps_file_mode(task_files):
+    os.chmod(app.TASKS_FILE, 0o644)
+
+    app.save_tasks([{'title': 'a', 'completed': False}])
+
+    assert stat.S_IMODE(os.stat(app.TASKS_FILE).st_mode) == 0o644
+    assert app.load_tasks() == [{'title': 'a', 'completed': False}]
+
+
+def test_new_file_mode_follows_umask(tmp_path):
+    path = str(tmp_path / 'new.json')
+
+    app.write_file_atomic(path, b'[]')
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o666 & ~app._umask
+    assert os.listdir(tmp_path) == ['new.json']
+
+
+def test_writes_after_torn_journal_tail_survive_restart(task_files):
+    store = app.TaskStore()
+    store.add('a')
+    store.add('b')
+    with open(app.TASKS_JOURNAL_FILE, 'ab') as file:
+        file.write(b'{"op": "add", "ti')
+
+    store = app.TaskStore()
+    store.add('c')
+    store.add('d')
+
+    expected = ['a', 'b', 'c', 'd']
+    assert [task['title'] for task in store.all()] == expected
+    assert [task['title'] for task in app.TaskStore().all()] == expected
+
+
+def test_sqlite_import_includes_journal_operations(task_files):
+    journal = app.TaskStore()
+    for title in ('a', 'b', 'c'):
+        journal.add(title)
+    journal.complete(1)
+
+    assert app.SQLiteTaskStore().all() == journal.all()